@@ -5,8 +5,9 @@ import pandas as pd
 import numpy as np
 import plotly.express as px
 from utils.db import listeria_collection
+from utils.aggregations import cube_counts, cube_kpis, trend_cube
+from utils.schema import SUB_AREAS
 import plotly.graph_objects as go
-from collections import OrderedDict
 
 
 # 🔐 Authentication check
@@ -21,21 +22,17 @@ if st.sidebar.button("Logout"):
     st.success("🔓 Logged out successfully.")
     st.stop()
 
-# Load Data
-data = pd.DataFrame(list(listeria_collection.find()))
+# Load Data: one aggregated cube per rerun; every KPI and chart below is a
+# slice of it (see utils/aggregations.py)
+cube = trend_cube(listeria_collection)
+kpis = cube_kpis(cube)
 col1, col2, col3 = st.columns(3)
-col1.metric("Total Samples", len(data))
-col2.metric("Detected", data[data["test_result"] != "Not Detected"].shape[0])
-col3.metric("Detection Rate", f"{(data[data['test_result'] != 'Not Detected'].shape[0] / len(data)) * 100:.2f}%")
+col1.metric("Total Samples", kpis["total"])
+col2.metric("Detected", kpis["detected"])
+col3.metric("Detection Rate", f"{(kpis['detected'] / kpis['total']) * 100:.2f}%")
 #####################################################
-# Ensure sample_date is datetime
-data['sample_date'] = pd.to_datetime(data['sample_date'])
-
 # Group by day
-daily_summary = data.groupby('sample_date')['test_result'].agg(
-    total_samples='count',
-    detected_tests=lambda x: (x == 'Detected').sum()
-).reset_index()
+daily_summary = cube_counts(cube, ['sample_date'])
 
 # Create Plotly Figure
 fig = go.Figure()
@@ -97,15 +94,10 @@ st.plotly_chart(fig, use_container_width=True, key='daily_total_vs_detected')
 
 
 # Compute detection stats by week (without categorizing by before_during)
-grouped = data.groupby(['week'])
-
-summary = grouped['test_result'].agg(
-    total_tests='count',
-    detected_tests=lambda x: (x == 'Detected').sum()
-).reset_index()
+summary = cube_counts(cube, ['week'])
 
 summary['detection_rate_percent'] = (
-    (summary['detected_tests'] / summary['total_tests']) * 100
+    (summary['detected_tests'] / summary['total_samples']) * 100
 ).round(1)
 
 # Extract numeric part of week for proper sorting (e.g., "Week-12" → 12)
@@ -133,7 +125,7 @@ fig = go.Figure()
 # Bar for total tests
 fig.add_trace(go.Bar(
     x=summary['week'],
-    y=summary['total_tests'],
+    y=summary['total_samples'],
     name='Total Tests',
     marker_color='#dac3e8',
     yaxis='y1'
@@ -180,19 +172,11 @@ fig.update_layout(
 st.plotly_chart(fig, use_container_width=True)
 
 ################################################
-# Ensure sample_date is datetime
-data['sample_date'] = pd.to_datetime(data['sample_date'])
-
 # Group by actual sample_date (daily)
-grouped = data.groupby('sample_date')
-
-summary = grouped['test_result'].agg(
-    total_tests='count',
-    detected_tests=lambda x: (x == 'Detected').sum()
-).reset_index()
+summary = cube_counts(cube, ['sample_date'])
 
 summary['detection_rate_percent'] = (
-    (summary['detected_tests'] / summary['total_tests']) * 100
+    (summary['detected_tests'] / summary['total_samples']) * 100
 ).round(1)
 
 # Sort by date for plotting
@@ -213,7 +197,7 @@ fig = go.Figure()
 # Total tests (bar)
 fig.add_trace(go.Bar(
     x=summary['sample_date'],
-    y=summary['total_tests'],
+    y=summary['total_samples'],
     name='Total Tests',
     marker_color='#a06cd5',
     yaxis='y1',
@@ -273,10 +257,7 @@ st.plotly_chart(fig, use_container_width=True, key='detection_summary_trend')
 
 
 
-area_summary = data.groupby('sub_area')['test_result'].agg(
-    total_samples='count',
-    detected_tests=lambda x: (x == 'Detected').sum()
-).reset_index()
+area_summary = cube_counts(cube, ['sub_area'])
 
 
 area_summary['detection_rate_percent'] = (
@@ -284,17 +265,8 @@ area_summary['detection_rate_percent'] = (
 ).round(1)
 
 
-custom_order = [
-    # Fresh
-    'PRODUCTION', 'DEBONING', 'DESKINNING', 'INJECTOR',
-    'WASHER', 
-    # Smoking + Packing
-    'ENTRANCE', 'LKPW1', 'LKPW2', 'CFS',
-    'OTHER'
-    # # Unmapped
-    # 'Unmapped'
-]
-custom_order = list(OrderedDict.fromkeys(custom_order))
+# Process-flow order: Fresh areas, then Smoking + Packing (utils/schema.py)
+custom_order = SUB_AREAS
 area_summary['sub_area'] = pd.Categorical(
     area_summary['sub_area'], 
     categories=custom_order, 
@@ -343,21 +315,15 @@ st.plotly_chart(fig, use_container_width=True, key="samples_vs_detection_rate")
 
 
 
+# Day-wise counts per department and production phase, shared by charts 3-6
+department_summary = cube_counts(cube, ['sample_date', 'fresh_smoked', 'before_during'])
+
 # 3 Filter for 'Fresh Fish Department' 'Before Production'
 # filtered = data[data['before_during'] == 'BP']
-filtered = data[
-    (data['before_during'] == 'BP') &
-    (data['fresh_smoked'] == 'Fresh')
-]
-
-# Ensure date column is datetime
-filtered['sample_date'] = pd.to_datetime(filtered['sample_date'])
-
-# Group by Date
-date_summary = filtered.groupby('sample_date')['test_result'].agg(
-    total_samples='count',
-    detected_tests=lambda x: (x == 'Detected').sum()
-).reset_index()
+date_summary = department_summary[
+    (department_summary['before_during'] == 'BP') &
+    (department_summary['fresh_smoked'] == 'Fresh')
+].copy()
 
 # Calculate detection rate
 date_summary['detection_rate_percent'] = (
@@ -424,18 +390,10 @@ st.plotly_chart(fig, use_container_width=True, key='before_production_trend')
 
 # 4 Filter for 'Fresh Fish Department' 'During Production'
 
-filtered = data[
-    (data['before_during'] == 'DP') &
-    (data['fresh_smoked'] == 'Fresh')
-]
-# Ensure date column is datetime
-filtered['sample_date'] = pd.to_datetime(filtered['sample_date'])
-
-# Group by Date
-date_summary = filtered.groupby('sample_date')['test_result'].agg(
-    total_samples='count',
-    detected_tests=lambda x: (x == 'Detected').sum()
-).reset_index()
+date_summary = department_summary[
+    (department_summary['before_during'] == 'DP') &
+    (department_summary['fresh_smoked'] == 'Fresh')
+].copy()
 
 # Calculate detection rate
 date_summary['detection_rate_percent'] = (
@@ -503,19 +461,10 @@ st.plotly_chart(fig, use_container_width=True, key='during_production_trend')
 
 # 5 Filter for 'Fresh Fish Department' 'Before Production'
 # filtered = data[data['before_during'] == 'BP']
-filtered = data[
-    (data['before_during'] == 'BP') &
-    (data['fresh_smoked'] == 'Smoking + Packing')
-]
-
-# Ensure date column is datetime
-filtered['sample_date'] = pd.to_datetime(filtered['sample_date'])
-
-# Group by Date
-date_summary = filtered.groupby('sample_date')['test_result'].agg(
-    total_samples='count',
-    detected_tests=lambda x: (x == 'Detected').sum()
-).reset_index()
+date_summary = department_summary[
+    (department_summary['before_during'] == 'BP') &
+    (department_summary['fresh_smoked'] == 'Smoking + Packing')
+].copy()
 
 # Calculate detection rate
 date_summary['detection_rate_percent'] = (
@@ -583,18 +532,10 @@ st.plotly_chart(fig, use_container_width=True, key='before_production_smoked_tre
 
 # 6 Filter for 'Fresh Fish Department' 'During Production'
 
-filtered = data[
-    (data['before_during'] == 'DP') &
-    (data['fresh_smoked'] == 'Smoking + Packing')
-]
-# Ensure date column is datetime
-filtered['sample_date'] = pd.to_datetime(filtered['sample_date'])
-
-# Group by Date
-date_summary = filtered.groupby('sample_date')['test_result'].agg(
-    total_samples='count',
-    detected_tests=lambda x: (x == 'Detected').sum()
-).reset_index()
+date_summary = department_summary[
+    (department_summary['before_during'] == 'DP') &
+    (department_summary['fresh_smoked'] == 'Smoking + Packing')
+].copy()
 
 # Calculate detection rate
 date_summary['detection_rate_percent'] = (
@@ -663,32 +604,8 @@ st.plotly_chart(fig, use_container_width=True, key='during_production_Smoked_tre
 
 
 ###############################################################
-# --- Map sub_area to departments ---
-fresh_areas = ['PRODUCTION', 'DEBONING', 'DESKINNING', 'INJECTOR', 'WASHER']
-smoking_packing_areas = ['ENTRANCE', 'LKPW1', 'LKPW2', 'CFS', 'OTHER']
-
-# Assign department based on sub_area
-def assign_department(area):
-    if area in fresh_areas:
-        return 'Fresh'
-    elif area in smoking_packing_areas:
-        return 'Smoking + Packing'
-    else:
-        return 'Unmapped'
-
-data['department'] = data['sub_area'].apply(assign_department)
-
-# --- Filter for valid departments only ---
-data = data[data['department'].isin(['Fresh', 'Smoking + Packing'])]
-
-# --- Ensure sample_date is datetime ---
-data['sample_date'] = pd.to_datetime(data['sample_date'])
-
-# --- Group by sample_date and department ---
-grouped = data.groupby(['sample_date', 'department'])['test_result'].agg(
-    total_samples='count',
-    detected_tests=lambda x: (x == 'Detected').sum()
-).reset_index()
+# --- Group by sample_date and department (sub_area -> department, unmapped areas dropped) ---
+grouped = cube_counts(cube, ['sample_date', 'department'])
 
 # --- Calculate detection rate ---
 grouped['detection_rate_percent'] = (
@@ -1,6 +1,16 @@
 import streamlit as st
-import pandas as pd
-from utils.db import listeria_collection
+from utils.db import db, listeria_collection, locations_collection, pool_stats, zones_collection
+from utils.data import load_frame, invalidate_listeria
+from utils.aggregations import check_parity
+from utils.rollup import rebuild_rollup
+from utils.indexes import ensure_indexes, verify_query_plans
+from utils.locations import build_registry, join_locations, load_locations, set_location
+from utils.map_registry import MAP_DEPARTMENTS
+from utils.zones import delete_zone, load_zones, parse_polygon, save_zone
+from utils.floorplan import floor_plan
+from utils.map_engine import load_map_data
+from utils.registration import REGISTRATION_AVAILABLE, apply_homography, decode_image, estimate_homography, preview_figure, read_image, remap_filter, remap_zones
+from utils.ingest import INGEST_COUNTS, ingest_csv, missing_columns, read_preview, remove_duplicate_samples
 
 # 🔐 Check if user is logged in
 if "user" not in st.session_state:
@@ -25,7 +35,7 @@ st.title("📁 Admin: Upload Listeria Results Data")
 uploaded_file = st.file_uploader("Upload Results File", type=["csv"])
 if uploaded_file:
     try:
-        df = pd.read_csv(uploaded_file, encoding="utf-8", encoding_errors="replace")
+        df = read_preview(uploaded_file)
     except Exception as e:
         st.error(f"Error reading CSV file: {e}")
         st.stop()
@@ -33,44 +43,58 @@ if uploaded_file:
     st.write(df.head())  # Preview data
 
     # ✅ Required columns
-    required_columns = {
-        "sample_code", "sample_description", "translated_description", "test_code", "test_result", "unit",
-        "analytical_report_code", "sample_date", "location_code", "fresh_smoked", "sub_area",
-        "before_during", "value", "week_num", "week", "x", "y", "points"
-    }
-
-    if not required_columns.issubset(df.columns):
-        st.error(f"Missing required columns: {', '.join(required_columns - set(df.columns))}")
+    missing = missing_columns(df.columns)
+    if missing:
+        st.error(f"Missing required columns: {', '.join(sorted(missing))}")
         st.stop()
 
-    # 🕓 Date parsing
-    df["sample_date"] = pd.to_datetime(df["sample_date"], format="%d-%m-%Y", errors="coerce")
-    df["sample_date"] = df["sample_date"].where(df["sample_date"].notna(), None)
-
     # 🧑 Add uploader info
     username = st.session_state.user.get("username", "admin")
-    df["uploaded_by"] = username
 
-    # 📤 Upload to MongoDB
+    # 📤 Upload to MongoDB, one chunk of rows at a time. Samples already
+    # stored (same sample, test and report code) are updated, not duplicated.
     if st.button("Upload to MongoDB"):
+        progress = st.progress(0.0, text="Uploading...")
+        rows = 0
+        totals = dict.fromkeys(INGEST_COUNTS, 0)
+        conflicting_codes = set()
         try:
-            data_list = df.to_dict(orient="records")
-            result = listeria_collection.insert_many(data_list)
-            st.success(f"✅ Inserted {len(result.inserted_ids)} records into the database!")
+            for chunk_rows, counts, codes, seconds in ingest_csv(listeria_collection, locations_collection, uploaded_file, username):
+                rows += chunk_rows
+                for name in INGEST_COUNTS:
+                    totals[name] += counts[name]
+                conflicting_codes |= codes
+                rate = chunk_rows / seconds if seconds else 0
+                progress.progress(
+                    min(uploaded_file.tell() / max(uploaded_file.size, 1), 1.0),
+                    text=f"{rows:,} rows read ({rate:,.0f} rows/s)",
+                )
+            progress.progress(1.0, text=f"{rows:,} rows read")
+            st.success(f"✅ Inserted {totals['inserted']}, updated {totals['updated']} and left {totals['unchanged']} unchanged record(s)!")
+            if totals["skipped"]:
+                st.warning(f"⚠️ Skipped {totals['skipped']} row(s) superseded by a later row with the same sample, test and report code.")
+            if totals["conflicting"]:
+                st.warning(
+                    f"⚠️ {totals['conflicting']} row(s) carried X/Y different from the location registry, which was kept: "
+                    f"{', '.join(sorted(conflicting_codes))}. Use the X/Y tool below to move a location."
+                )
         except Exception as e:
-            st.error(f"❌ Database Error: {e}")
+            st.error(f"❌ Database Error after {totals['inserted']} inserted and {totals['updated']} updated records: {e}")
+            if totals["inserted"] or totals["updated"]:
+                st.warning("Rebuild the rollup below if the Trend Analysis counts look off.")
+        finally:
+            if totals["inserted"] or totals["updated"]:
+                invalidate_listeria(rewritten=totals["updated"] > 0)
 
 # 📥 Download existing MongoDB collection as CSV
 st.subheader("📥 Download MongoDB Data")
 
 try:
-    data = list(listeria_collection.find({}))
-    if not data:
+    # x/y come from the location registry where the samples no longer carry them
+    df_export = join_locations(load_frame(listeria_collection, projection={"_id": 0}), load_locations(locations_collection))
+    if df_export.empty:
         st.warning("⚠️ No data found in the collection.")
     else:
-        df_export = pd.DataFrame(data)
-        if "_id" in df_export.columns:
-            df_export.drop(columns=["_id"], inplace=True)
         csv = df_export.to_csv(index=False).encode("utf-8")
         st.download_button(
             label="📄 Download Listeria Collection as CSV",
@@ -85,7 +109,7 @@ except Exception as e:
 st.subheader("🛠️ Update X/Y Coordinates for a Location Code")
 
 try:
-    location_codes = listeria_collection.distinct("location_code")
+    location_codes = set(listeria_collection.distinct("location_code")) | set(locations_collection.distinct("location_code"))
     if location_codes:
         selected_code = st.selectbox("Select Location Code", sorted([str(code) for code in location_codes if code]))
 
@@ -95,13 +119,171 @@ try:
             update_btn = st.form_submit_button("Update Coordinates")
 
             if update_btn:
-                result = listeria_collection.update_many(
-                    {"location_code": selected_code},
-                    {"$set": {"x": new_x, "y": new_y}}
-                )
-                st.success(f"✅ Updated {result.modified_count} record(s) for location_code = '{selected_code}'.")
+                # One registry document; the maps join it to the samples at
+                # read time, so only cached frames go stale
+                set_location(locations_collection, listeria_collection, selected_code, new_x, new_y)
+                invalidate_listeria()
+                st.success(f"✅ Moved location_code = '{selected_code}' to ({new_x:g}, {new_y:g}).")
     else:
         st.info("No location_code values found in database.")
 except Exception as e:
     st.error(f"Error loading location codes: {e}")
 
+
+# 📍 Location registry
+st.subheader("📍 Location Registry")
+st.caption("Register every sampled location with its latest X/Y. Optionally remove X/Y from the sample documents afterwards; the maps and the export read them from the registry.")
+
+strip_samples = st.checkbox("Remove X/Y from registered samples")
+if st.button("Build Location Registry"):
+    try:
+        registered, stripped = build_registry(locations_collection, listeria_collection, strip_samples=strip_samples)
+        invalidate_listeria(rewritten=stripped > 0)
+        st.success(f"✅ Registered {registered} location(s); removed X/Y from {stripped} sample(s).")
+    except Exception as e:
+        st.error(f"❌ Failed to build location registry: {e}")
+
+# 🗺️ Floor-plan zones
+st.subheader("🗺️ Floor-Plan Zones")
+st.caption("Polygons in floor-plan pixels, e.g. 120,80; 480,80; 480,260; 120,260. Saving an existing name replaces its polygon.")
+
+zone_area = st.selectbox("Floor Plan", list(MAP_DEPARTMENTS), format_func=lambda key: MAP_DEPARTMENTS[key]["title"])
+with st.form("zone_form"):
+    zone_name = st.text_input("Zone Name")
+    zone_polygon = st.text_area("Vertices (x,y; x,y; ...)")
+    if st.form_submit_button("Save Zone"):
+        try:
+            if not zone_name.strip():
+                raise ValueError("Zone name is required")
+            save_zone(zones_collection, zone_area, zone_name.strip(), parse_polygon(zone_polygon))
+            invalidate_listeria()
+            st.success(f"✅ Saved zone '{zone_name.strip()}'.")
+        except ValueError as e:
+            st.error(f"❌ {e}")
+        except Exception as e:
+            st.error(f"❌ Failed to save zone: {e}")
+
+try:
+    area_zones = load_zones(zones_collection).get(zone_area, [])
+    if area_zones:
+        st.table([{"Zone": name, "Vertices": len(polygon)} for name, polygon in area_zones])
+        removed = st.selectbox("Zone to Delete", [name for name, _ in area_zones])
+        if st.button("Delete Zone"):
+            delete_zone(zones_collection, zone_area, removed)
+            invalidate_listeria()
+            st.success(f"✅ Deleted zone '{removed}'.")
+    else:
+        st.info("No zones defined for this floor plan.")
+except Exception as e:
+    st.error(f"Error loading zones: {e}")
+
+# 📐 Floor-plan registration
+st.subheader("📐 Floor-Plan Registration")
+
+if REGISTRATION_AVAILABLE:
+    st.caption("After a floor plan is redrawn, upload the previous image. The transform from the old image to the current one is estimated from matching features, previewed on the stored points and zones, then applied to every stored X/Y and zone of that floor plan.")
+
+    registration_area = st.selectbox("Floor Plan to Register", list(MAP_DEPARTMENTS), format_func=lambda key: MAP_DEPARTMENTS[key]["title"])
+    previous_plan = st.file_uploader("Previous Floor-Plan Image", type=["png", "jpg", "jpeg", "webp"])
+
+    if previous_plan and st.button("Estimate Transform"):
+        try:
+            homography, inliers, matches = estimate_homography(
+                decode_image(previous_plan.getvalue()),
+                read_image(MAP_DEPARTMENTS[registration_area]["floor_plan"]),
+            )
+            st.session_state["registration"] = {
+                "area": registration_area, "homography": homography.tolist(), "inliers": inliers, "matches": matches,
+            }
+        except ValueError as e:
+            st.session_state.pop("registration", None)
+            st.error(f"❌ {e}")
+
+    registration = st.session_state.get("registration")
+    if previous_plan and registration and registration["area"] == registration_area:
+        try:
+            st.write(f"{registration['inliers']} of {registration['matches']} matched features agree on the transform.")
+            plan = floor_plan(MAP_DEPARTMENTS[registration_area]["floor_plan"])
+            positions = load_map_data(listeria_collection).positions[registration_area]
+            registration_zones = load_zones(zones_collection).get(registration_area, [])
+            if plan is not None and not positions.empty:
+                st.plotly_chart(preview_figure(registration_area, positions, registration["homography"], plan[1], registration_zones), use_container_width=True)
+
+            # Registry entries and samples that still carry their own X/Y, and zones
+            location_count = locations_collection.count_documents(remap_filter(registration_area))
+            sample_count = listeria_collection.count_documents(remap_filter(registration_area))
+            zone_count = zones_collection.count_documents({"area": registration_area})
+            if st.button(f"Apply to {location_count} location(s), {sample_count} sample(s) and {zone_count} zone(s)"):
+                moved_locations = apply_homography(locations_collection, registration_area, registration["homography"])
+                moved_samples = apply_homography(listeria_collection, registration_area, registration["homography"])
+                moved_zones = remap_zones(zones_collection, registration_area, registration["homography"])
+                invalidate_listeria(rewritten=moved_samples > 0)
+                st.session_state.pop("registration", None)
+                st.success(f"✅ Remapped {moved_locations} location(s), {moved_samples} sample(s) and {moved_zones} zone(s).")
+        except Exception as e:
+            st.error(f"❌ Registration failed: {e}")
+else:
+    st.info("Floor-plan registration needs OpenCV (opencv-python-headless).")
+
+# 📊 MongoDB connection pool health
+st.subheader("📊 Database Connection Pool")
+
+stats = pool_stats()
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Checked Out", f"{stats['checked_out']} / {stats['max_pool_size']}")
+col2.metric("Connections Created", stats["connections_created"])
+col3.metric("Avg Wait (ms)", stats["wait_avg_ms"])
+col4.metric("Max Wait (ms)", stats["wait_max_ms"])
+with st.expander("Pool details"):
+    st.json(stats)
+
+# 🧮 Daily rollup feeding the Trend charts and KPIs
+st.subheader("🧮 Daily Rollup")
+st.caption("Build the rollup once (Trend Analysis groups the raw samples until then), and rebuild it from the raw samples after a failed upload or a manual database edit.")
+
+if st.button("Rebuild Daily Rollup"):
+    try:
+        rows = rebuild_rollup(listeria_collection)
+        invalidate_listeria()
+        st.success(f"✅ Rebuilt daily rollup with {rows} row(s).")
+    except Exception as e:
+        st.error(f"❌ Failed to rebuild rollup: {e}")
+
+# 🧹 Samples uploaded more than once before uploads were keyed
+st.subheader("🧹 Duplicate Samples")
+st.caption("Stores sample, test and report codes saved as numbers as text, keeps the latest upload of every sample, test and report code stored more than once, then rebuilds the rollup and the unique upload index. Samples missing one of the codes are kept as they are.")
+
+if st.button("Remove Duplicate Samples"):
+    try:
+        removed = remove_duplicate_samples(listeria_collection)
+        if removed:
+            rebuild_rollup(listeria_collection)
+            invalidate_listeria(rewritten=True)
+        ensure_indexes(db)
+        st.success(f"✅ Removed {removed} duplicate sample(s).")
+    except Exception as e:
+        st.error(f"❌ Failed to remove duplicates: {e}")
+
+# 🧪 Check that the server-side Trend aggregations match the pandas path
+st.subheader("🧪 Verify Trend Aggregations")
+
+if st.button("Run Parity Check"):
+    try:
+        checked = check_parity(listeria_collection)
+        st.success(f"✅ Rollup, Mongo and pandas cubes match the sample rows for all {checked} checks.")
+    except AssertionError as e:
+        st.error(f"❌ {e}")
+    except Exception as e:
+        st.error(f"❌ Parity check failed to run: {e}")
+
+# 🗂️ Indexes and query plans
+st.subheader("🗂️ Indexes and Query Plans")
+
+if st.button("Verify Query Plans"):
+    try:
+        ensure_indexes(db)
+        report = verify_query_plans(db)
+        st.success("✅ Every page query is served by an index.")
+        st.table([{"Query": label, "Plan": " → ".join(stages)} for label, stages in report])
+    except Exception as e:
+        st.error(f"❌ {e}")
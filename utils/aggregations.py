@@ -0,0 +1,172 @@
+import os
+
+import pandas as pd
+from pymongo.errors import PyMongoError
+
+from utils.data import load_aggregate, load_frame
+from utils.rollup import RAW_COUNTS, ROLLUP_BUILT, ROLLUP_COUNTS, count_rows, rollup_collection_for, rollup_state_for
+from utils.schema import DEPARTMENT_AREAS, TREND_FIELDS, decode_frame
+
+# Trend Analysis counts come from one aggregated cube,
+# (date, week, department, phase, sub area) -> sample counts, built in a
+# single $group and cached. Every chart and KPI is a slice of the cube, so a
+# rerun costs one cached query plus a few small in-memory groupbys. Backends:
+#   rollup - sum the materialized daily rollup (utils/rollup.py), the default
+#   mongo  - group the raw sample documents
+#   pandas - group the in-memory frame
+# The rollup falls back to the raw pipeline while it has not been built yet,
+# and any Mongo error falls back to pandas.
+AGGREGATION_BACKEND = os.getenv("TREND_AGGREGATION_BACKEND", "rollup")
+
+AREA_DEPARTMENT = {area: dept for dept, areas in DEPARTMENT_AREAS.items() for area in areas}
+
+CUBE_KEYS = ["sample_date", "week", "fresh_smoked", "before_during", "sub_area"]
+CUBE_FIELDS = {key: TREND_FIELDS[key] for key in CUBE_KEYS}
+
+COUNT_COLUMNS = ["total_samples", "detected_tests"]
+
+# Groupings used by the Trend Analysis charts
+TREND_GROUPINGS = [
+    ("sample_date",),
+    ("week",),
+    ("sub_area",),
+    ("sample_date", "fresh_smoked", "before_during"),
+    ("sample_date", "department"),
+]
+
+
+def cube_pipeline(rollup=False):
+    counts = {count: {"$sum": f"${count}"} for count in ROLLUP_COUNTS} if rollup else RAW_COUNTS
+    return [
+        {"$group": {
+            "_id": {key: {"$ifNull": [f"${key}", None]} for key in CUBE_KEYS},
+            **counts,
+        }},
+        {"$project": {
+            "_id": 0,
+            **{key: f"$_id.{key}" for key in CUBE_KEYS},
+            **{count: 1 for count in ROLLUP_COUNTS},
+        }},
+    ]
+
+
+def _typed_cube(cube):
+    typed = decode_frame(cube, CUBE_FIELDS)
+    for count in ROLLUP_COUNTS:
+        typed[count] = cube[count].fillna(0).astype("int64")
+    return typed
+
+
+def trend_cube(collection, backend=None):
+    columns = CUBE_KEYS + ROLLUP_COUNTS
+    cube = None
+    try:
+        backend = _resolve_backend(collection, backend)
+        if backend == "rollup":
+            cube = load_aggregate(rollup_collection_for(collection), cube_pipeline(rollup=True), columns=columns)
+        elif backend == "mongo":
+            cube = load_aggregate(collection, cube_pipeline(), columns=columns)
+    except PyMongoError:
+        pass
+    if cube is None:
+        cube = count_rows(_trend_data(collection), CUBE_KEYS)
+    return _typed_cube(cube)
+
+
+def cube_counts(cube, keys):
+    # One chart's counts: sum the cube over every key not in keys. Rows with a
+    # missing key are dropped, as pandas groupby and the charts always did.
+    keys = list(keys)
+    if "department" in keys:
+        # sub_area -> department; areas outside DEPARTMENT_AREAS are dropped
+        cube = cube.assign(department=cube["sub_area"].astype(object).map(AREA_DEPARTMENT))
+    summary = (
+        cube.dropna(subset=keys)
+        .groupby(keys, observed=True)[["total", "detected"]]
+        .sum()
+        .reset_index()
+        .rename(columns={"total": "total_samples", "detected": "detected_tests"})
+    )
+    return summary[keys + COUNT_COLUMNS]
+
+
+def cube_kpis(cube):
+    samples = int(cube["samples"].sum())
+    # Everything that is not "Not Detected" counts as detected
+    return {"total": samples, "detected": samples - int(cube["not_detected"].sum())}
+
+
+def count_frame(data, keys):
+    # Reference counts straight from the sample rows, used by check_parity()
+    keys = list(keys)
+    if "department" in keys:
+        data = data.assign(department=data["sub_area"].map(AREA_DEPARTMENT))
+    detected = (data["test_result"] == "Detected").astype(int)
+    summary = (
+        data.assign(_detected=detected)
+        .groupby(keys)
+        .agg(total_samples=("test_result", "count"), detected_tests=("_detected", "sum"))
+        .reset_index()
+    )
+    return summary[keys + COUNT_COLUMNS]
+
+
+def kpi_frame(data):
+    return {"total": len(data), "detected": int((data["test_result"] != "Not Detected").sum())}
+
+
+def _trend_data(collection):
+    return load_frame(collection, schema=TREND_FIELDS)
+
+
+def _rollup_ready(collection):
+    # The marker rebuild_rollup writes; rows alone may be just recent uploads
+    probe = [{"$match": ROLLUP_BUILT}, {"$project": {"_id": 1}}]
+    return not load_aggregate(rollup_state_for(collection), probe).empty
+
+
+def _resolve_backend(collection, backend):
+    backend = backend or AGGREGATION_BACKEND
+    if backend == "rollup" and not _rollup_ready(collection):
+        # Not backfilled yet (see rebuild_rollup); group the raw samples instead
+        return "mongo"
+    return backend
+
+
+def _normalized(frame, keys):
+    # Categorical keys sort in category order; compare them as plain text
+    frame = frame.astype({key: "str" for key in keys if isinstance(frame[key].dtype, pd.CategoricalDtype)})
+    frame = frame.sort_values(list(keys)).reset_index(drop=True)
+    for column in COUNT_COLUMNS:
+        frame[column] = frame[column].astype("int64")
+    if "sample_date" in frame.columns:
+        frame["sample_date"] = pd.to_datetime(frame["sample_date"]).astype("datetime64[ms]")
+    return frame
+
+
+def _check_counts(label, server, local, keys):
+    try:
+        pd.testing.assert_frame_equal(_normalized(server, keys), _normalized(local, keys), check_dtype=False)
+    except AssertionError as e:
+        raise AssertionError(f"{label} mismatch for {keys}: {e}") from e
+
+
+def _check_kpis(label, server, local):
+    if server != local:
+        raise AssertionError(f"{label} KPI mismatch: cube={server} pandas={local}")
+
+
+def check_parity(collection):
+    # Builds the cube from the raw pipeline, the rollup and pandas, and checks
+    # every Trend grouping and the KPIs sliced from each against counts taken
+    # straight from the sample rows. Raises AssertionError on the first
+    # result that differs.
+    data = _trend_data(collection)
+    checks = 0
+    for backend in ("mongo", "rollup", "pandas"):
+        cube = trend_cube(collection, backend)
+        for keys in TREND_GROUPINGS:
+            _check_counts(f"{backend} cube", cube_counts(cube, keys), count_frame(data, keys), keys)
+        _check_kpis(f"{backend} cube", cube_kpis(cube), kpi_frame(data))
+        checks += len(TREND_GROUPINGS) + 1
+    return checks
@@ -0,0 +1,409 @@
+import struct
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+import bson
+
+from utils.schema import FIELD_ALIASES, as_text, to_int8, category_dtype, projection_for
+
+# Columnar loader for schema-typed frames. Instead of building a dict per
+# document and letting pandas infer every column, it reads raw BSON batches
+# (find_raw_batches) and pulls every declared field straight into a typed
+# column: datetime64[us] dates, float32 numbers, Int8 flags and Categoricals
+# built directly from int32 codes. The result matches
+# utils.schema.decode_frame; both read codes as text through
+# utils.schema.as_text.
+#
+# A batch is scanned in place with NumPy (_scan_batch): the documents are
+# walked element by element in lockstep, every declared field's type and
+# value offset is recorded, and the values are gathered per BSON type. Only
+# the distinct values of a batch become Python objects. A batch holding a
+# type the scanner does not read (e.g. a bool or an embedded document in a
+# declared field) is decoded with bson.decode_all instead.
+
+
+class _Column:
+    # Dates, strings and flags are dictionary-encoded while reading: listeria
+    # fields repeat heavily (one date per day, one code per sampling point), so
+    # each distinct value is converted once and rows only carry an int32 code.
+    def __init__(self, field, kind):
+        if kind not in ("datetime", "float32", "int8", "str", "category"):
+            raise ValueError(f"Unknown column type '{kind}'")
+        self.field = field
+        self.kind = kind
+        self.chunks = []
+        self.index = {}
+
+    def add_encoded(self, codes, uniques):
+        # codes: int32 per row into uniques (Python values), -1 if missing
+        index = self.index
+        lookup = np.array([index.setdefault(v, len(index)) for v in uniques] + [-1], dtype=np.int32)
+        self.chunks.append(lookup[codes])
+
+    def add(self, values):
+        if self.kind == "float32":
+            # Coordinates rarely repeat; convert the batch directly
+            self.chunks.append(_to_float32(values))
+            return
+        index = self.index
+        # NaN (blank CSV cells) is missing too, and never equal to itself
+        codes = [-1 if v is None or v != v else index.setdefault(v, len(index)) for v in values]
+        self.chunks.append(np.array(codes, dtype=np.int32))
+
+    def _uniques(self):
+        # Converted distinct values plus a trailing missing-value slot
+        uniques = list(self.index) + [None]
+        if self.kind == "datetime":
+            return _to_datetime64(uniques)
+        if self.kind == "int8":
+            return to_int8(pd.Series(uniques, dtype=object)).array
+        table = np.empty(len(uniques), dtype=object)
+        table[:] = [as_text(v) for v in uniques]
+        return table
+
+    def finish(self):
+        if self.kind == "float32":
+            return pd.Series(np.concatenate(self.chunks) if self.chunks else np.array([], dtype=np.float32))
+        codes = np.concatenate(self.chunks) if self.chunks else np.array([], dtype=np.int32)
+        uniques = self._uniques()
+        if self.kind == "category":
+            # Re-point the codes at the canonical category order
+            dtype = category_dtype(self.field, {v for v in uniques if v is not None})
+            positions = dtype.categories.get_indexer(uniques)
+            return pd.Series(pd.Categorical.from_codes(positions.take(codes), dtype=dtype))
+        # code -1 wraps around to the trailing missing-value slot
+        values = uniques.take(codes)
+        return pd.Series(values, dtype="str" if self.kind == "str" else None)
+
+
+def _to_datetime64(values):
+    try:
+        return np.array(values, dtype="datetime64[us]")
+    except (TypeError, ValueError):
+        # Dates stored as text by an older upload
+        return pd.to_datetime(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype="datetime64[us]")
+
+
+def _to_float32(values):
+    try:
+        return np.array(values, dtype=np.float32)
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=np.float32)
+
+
+def _field_values(docs, field):
+    values = list(map(dict.get, docs, repeat(field)))
+    for alias in FIELD_ALIASES.get(field, []):
+        values = [d.get(alias) if v is None or v != v else v for v, d in zip(values, docs)]
+    return values
+
+
+# BSON element types the scanner reads values of
+_DOUBLE, _STRING, _OBJECT_ID, _DATETIME, _NULL, _INT32, _INT64 = 0x01, 0x02, 0x07, 0x09, 0x0A, 0x10, 0x12
+_UNDEFINED = 0x06
+_MISSING_TYPES = (0, _NULL, _UNDEFINED)
+
+# Bytes to step over per element type: a fixed size, plus the int32 at the
+# value start for length-prefixed types. -1: types it cannot step over.
+_FIXED_SIZE = np.full(256, -1, dtype=np.int64)
+_PREFIXED = np.zeros(256, dtype=bool)
+for _type, _size in {0x01: 8, 0x06: 0, 0x07: 12, 0x08: 1, 0x09: 8, 0x0A: 0, 0x10: 4,
+                     0x11: 8, 0x12: 8, 0x13: 16, 0x7F: 0, 0xFF: 0}.items():
+    _FIXED_SIZE[_type] = _size
+for _type, _size in {0x02: 4, 0x03: 0, 0x04: 0, 0x05: 5, 0x0D: 4, 0x0E: 4, 0x0F: 0}.items():
+    _FIXED_SIZE[_type] = _size
+    _PREFIXED[_type] = True
+
+# Longest string value the scanner reads in place; batches are zero-padded
+# by this much so no read runs past the end
+_STRING_WINDOW = 1024
+
+
+def _gather(data, offsets, width):
+    # (rows, width) bytes starting at each offset
+    return np.lib.stride_tricks.sliding_window_view(data, width)[offsets]
+
+
+def _numbers(data, offsets, dtype):
+    dtype = np.dtype(dtype)
+    return np.ascontiguousarray(_gather(data, offsets, dtype.itemsize)).view(dtype).ravel()
+
+
+def _document_starts(batch):
+    starts = []
+    position, end = 0, len(batch)
+    unpack = struct.Struct("<i").unpack_from
+    while position < end:
+        starts.append(position)
+        length = unpack(batch, position)[0]
+        if length < 5:
+            return None
+        position += length
+    return np.array(starts, dtype=np.int64) if position == end else None
+
+
+def _scan_elements(batch, data, starts, names):
+    # {name: (element type per document, 0 if absent; value offset)}, or None
+    # when a document holds an element the scanner cannot step over
+    count = len(starts)
+    ends = starts + _numbers(data, starts, "<i4") - 1
+    if (ends >= len(batch)).any() or (ends < starts + 4).any():
+        return None
+    found = {name: (np.zeros(count, dtype=np.uint8), np.full(count, -1, dtype=np.int64)) for name in names}
+    # Element names are matched as fixed-width byte strings against the
+    # sorted declared names, one lookup per element
+    width = max(len(name.encode()) for name in names) + 1
+    known = np.array(sorted(name.encode() for name in names), dtype=f"S{width}")
+    lookup = sorted(names, key=str.encode)
+    window = np.arange(width)
+    position = starts + 4
+    active = np.flatnonzero(position < ends)
+    while len(active):
+        at = position[active]
+        types = data[at]
+        chars = _gather(data, at + 1, width)
+        terminated = chars == 0
+        named = terminated.any(axis=1)
+        name_length = terminated.argmax(axis=1)
+        for row in np.flatnonzero(~named):
+            # A longer, undeclared name
+            name_length[row] = batch.index(b"\0", at[row] + 1) - at[row] - 1
+        chars[window >= name_length[:, None]] = 0
+        keys = chars.view(f"S{width}").ravel()
+        slots = np.minimum(np.searchsorted(known, keys), len(known) - 1)
+        matched = named & (known[slots] == keys)
+        values = at + name_length + 2
+        for slot in np.unique(slots[matched]):
+            match = matched & (slots == slot)
+            element_types, offsets = found[lookup[slot]]
+            element_types[active[match]] = types[match]
+            offsets[active[match]] = values[match]
+        size = _FIXED_SIZE[types]
+        if (size < 0).any():
+            return None
+        prefixed = _PREFIXED[types]
+        if prefixed.any():
+            if (values[prefixed] + 4 > ends[active[prefixed]]).any():
+                return None
+            size[prefixed] += _numbers(data, values[prefixed], "<i4")
+        position[active] = values + size
+        if (position[active] > ends[active]).any():
+            return None
+        active = active[position[active] < ends[active]]
+    return found
+
+
+def _factorize(keys):
+    # (code per key, distinct keys), hashing rather than sorting; byte
+    # strings of up to 8 bytes hash as integers
+    if keys.dtype.kind == "S":
+        if keys.dtype.itemsize > 8:
+            distinct, inverse = np.unique(keys, return_inverse=True)
+            return inverse.ravel(), distinct
+        padded = np.zeros(len(keys), dtype="S8")
+        padded[:] = keys
+        inverse, distinct = pd.factorize(padded.view("<u8"))
+        return inverse, distinct.view("S8")
+    return pd.factorize(keys)
+
+
+def _encoded_values(data, types, offsets):
+    # (codes into uniques, -1 if missing; Python uniques) of one field, or
+    # None when it holds a type the scanner does not read
+    if not np.isin(types, (_DOUBLE, _INT32, _INT64, _DATETIME, _STRING) + _MISSING_TYPES).all():
+        return None
+    codes = np.full(len(types), -1, dtype=np.int32)
+    uniques = []
+
+    def add(rows, keys, convert):
+        if not rows.any():
+            return
+        inverse, distinct = _factorize(keys)
+        codes[rows] = inverse + len(uniques)
+        uniques.extend(convert(distinct))
+
+    # NaN (blank CSV cells) is missing too
+    rows = types == _DOUBLE
+    numbers = _numbers(data, offsets[rows], "<f8")
+    rows[rows] = ~np.isnan(numbers)
+    add(rows, numbers[~np.isnan(numbers)], lambda values: values.tolist())
+    for kind, dtype in ((_INT32, "<i4"), (_INT64, "<i8")):
+        rows = types == kind
+        add(rows, _numbers(data, offsets[rows], dtype), lambda values: values.tolist())
+    rows = types == _DATETIME
+    add(rows, _numbers(data, offsets[rows], "<i8"),
+        lambda values: values.astype("datetime64[ms]").tolist())
+    rows = types == _STRING
+    if rows.any():
+        starts = offsets[rows]
+        lengths = _numbers(data, starts, "<i4").astype(np.int64) - 1
+        width = int(lengths.max(initial=0))
+        if width > _STRING_WINDOW or (lengths < 0).any():
+            return None
+        width = max(width, 1)
+        chars = _gather(data, starts + 4, width)
+        chars[np.arange(width) >= lengths[:, None]] = 0
+        keys = np.ascontiguousarray(chars).view(f"S{width}").ravel()
+        try:
+            add(rows, keys, lambda values: [value.decode() for value in values])
+        except UnicodeDecodeError:
+            return None
+    return codes, uniques
+
+
+def _float_values(data, types, offsets):
+    if not np.isin(types, (_DOUBLE, _INT32, _INT64, _STRING) + _MISSING_TYPES).all():
+        return None
+    values = np.full(len(types), np.nan, dtype=np.float64)
+    for kind, dtype in ((_DOUBLE, "<f8"), (_INT32, "<i4"), (_INT64, "<i8")):
+        rows = types == kind
+        values[rows] = _numbers(data, offsets[rows], dtype)
+    rows = types == _STRING
+    if rows.any():
+        encoded = _encoded_values(data, np.where(rows, types, 0).astype(np.uint8), offsets)
+        if encoded is None:
+            return None
+        codes, uniques = encoded
+        numbers = pd.to_numeric(pd.Series(uniques + [None], dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+        values[rows] = numbers[codes[rows]]
+    return values.astype(np.float32)
+
+
+def _with_alias(data, own, alias):
+    # The alias's element wherever the field itself is missing (None or NaN)
+    types, offsets = own
+    missing = np.isin(types, _MISSING_TYPES)
+    doubles = np.flatnonzero(types == _DOUBLE)
+    missing[doubles[np.isnan(_numbers(data, offsets[doubles], "<f8"))]] = True
+    return np.where(missing, alias[0], types), np.where(missing, alias[1], offsets)
+
+
+def _scan_batch(batch, columns, with_ids):
+    # {field: encoded values} (and the _id strings) of one raw batch without
+    # decoding its documents, or None to decode it with bson.decode_all
+    starts = _document_starts(batch)
+    if starts is None:
+        return None
+    data = np.frombuffer(batch + bytes(_STRING_WINDOW + 8), dtype=np.uint8)
+    names = set(columns)
+    for field in columns:
+        names.update(FIELD_ALIASES.get(field, []))
+    if with_ids:
+        names.add("_id")
+    elements = _scan_elements(batch, data, starts, names)
+    if elements is None:
+        return None
+    values = {}
+    for field, column in columns.items():
+        element = elements[field]
+        for alias in FIELD_ALIASES.get(field, []):
+            element = _with_alias(data, element, elements[alias])
+        values[field] = _float_values(data, *element) if column.kind == "float32" else _encoded_values(data, *element)
+        if values[field] is None:
+            return None
+    ids = None
+    if with_ids:
+        types, offsets = elements["_id"]
+        if not (types == _OBJECT_ID).all():
+            return None
+        hexed = _gather(data, offsets, 12).tobytes().hex()
+        ids = [hexed[start:start + 24] for start in range(0, len(hexed), 24)]
+    return values, ids
+
+
+def frame_from_batches(batches, schema, with_ids=False):
+    # batches: iterable of raw BSON byte strings (concatenated documents)
+    columns = {field: _Column(field, kind) for field, kind in schema.items()}
+    ids = []
+    for batch in batches:
+        scanned = _scan_batch(batch, columns, with_ids) if batch else None
+        if scanned is not None:
+            values, batch_ids = scanned
+            for field, column in columns.items():
+                if column.kind == "float32":
+                    column.chunks.append(values[field])
+                else:
+                    column.add_encoded(*values[field])
+            if with_ids:
+                ids.extend(batch_ids)
+            continue
+        docs = bson.decode_all(batch)
+        if not docs:
+            continue
+        for field, column in columns.items():
+            column.add(_field_values(docs, field))
+        if with_ids:
+            ids.extend(str(d["_id"]) for d in docs)
+
+    frame = pd.DataFrame({field: column.finish() for field, column in columns.items()})
+    if with_ids:
+        frame.insert(0, "_id", pd.Series(ids, dtype=object))
+    return frame
+
+
+def load_columns(collection, query, schema, with_ids=False):
+    projection = projection_for(schema)
+    if with_ids:
+        projection["_id"] = 1
+    batches = collection.find_raw_batches(query or {}, projection)
+    return frame_from_batches(batches, schema, with_ids=with_ids)
+
+
+if __name__ == "__main__":
+    # Decode benchmark against the list-of-dicts path:
+    #   python -m utils.bson_loader [documents ...]
+    import sys
+    import time
+    import tracemalloc
+    from datetime import datetime, timedelta
+
+    from utils.schema import MAP_FIELDS, decode_frame
+
+    rng = np.random.default_rng(0)
+
+    def synthetic_batches(count, batch_bytes=16 * 1024 * 1024):
+        start = datetime(2025, 1, 1)
+        batches, parts, size = [], [], 0
+        for i in range(count):
+            doc = bson.encode({
+                "points": str(int(rng.integers(1, 120))),
+                "x": float(rng.uniform(0, 1600)),
+                "y": float(rng.uniform(0, 1400)),
+                "value": int(rng.random() < 0.1),
+                "sample_date": start + timedelta(days=int(rng.integers(0, 365))),
+                "location_code": f"L{int(rng.integers(1, 120)):03d}",
+                "before_during": "BP" if i % 2 else "DP",
+            })
+            parts.append(doc)
+            size += len(doc)
+            if size >= batch_bytes:
+                batches.append(b"".join(parts))
+                parts, size = [], 0
+        if parts:
+            batches.append(b"".join(parts))
+        return batches
+
+    def list_of_dicts(batches):
+        docs = []
+        for batch in batches:
+            docs.extend(bson.decode_all(batch))
+        return decode_frame(pd.DataFrame(docs), MAP_FIELDS)
+
+    for count in [int(n) for n in sys.argv[1:]] or [100_000, 1_000_000]:
+        batches = synthetic_batches(count)
+        timings = {}
+        for label, load in [("list-of-dicts", list_of_dicts),
+                            ("columnar", lambda b: frame_from_batches(b, MAP_FIELDS))]:
+            started = time.perf_counter()
+            load(batches)
+            seconds = time.perf_counter() - started
+            # Second run under tracemalloc for the peak working set
+            tracemalloc.start()
+            frame = load(batches)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            timings[label] = (seconds, peak / 2**20, frame.memory_usage(deep=True).sum() / 2**20)
+            del frame
+        for label, (seconds, peak, mib) in timings.items():
+            print(f"{count:>9,} docs  {label:<14} {seconds:7.3f} s  peak {peak:8.1f} MiB  frame {mib:7.1f} MiB")
@@ -0,0 +1,21 @@
+# Collection names and keys shared by utils.db, utils.indexes and the feature
+# modules. Kept free of imports so the connection module (and the Login page
+# behind it) does not load the data stack.
+
+# Location registry (utils.locations), one document per location_code
+LOCATIONS_COLLECTION = "locations"
+
+# Floor-plan zones (utils.zones), one document per (area, name)
+ZONES_COLLECTION = "zones"
+
+# Daily rollup of the samples (utils.rollup) and its key
+ROLLUP_COLLECTION = "listeria_daily_rollup"
+ROLLUP_KEYS = ["sample_date", "week", "fresh_smoked", "before_during", "sub_area", "location_code"]
+
+# Natural key of a sample, unique across uploads (utils.ingest)
+NATURAL_KEY = ["sample_code", "test_code", "analytical_report_code"]
+
+# Samples the unique natural-key index covers: every key field stored as
+# text. Samples missing a code (null, or NaN from a blank CSV cell) are
+# stored but left out of the index.
+NATURAL_KEY_FILTER = {field: {"$type": "string"} for field in NATURAL_KEY}
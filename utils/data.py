@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+from utils.bson_loader import load_columns
+from utils.schema import projection_for
+from utils.snapshot import SNAPSHOTS_ENABLED, drop_snapshots, load_snapshot
+
+# Decoded listeria frames shared by every page and session in this process.
+# One entry per query shape (collection + filter + projection/schema); entries expire
+# after CACHE_TTL_SECONDS and are dropped at once by invalidate_listeria().
+#
+# Frames handed out here are shared objects: pages must treat them as
+# read-only and take a .copy() before assigning columns.
+CACHE_TTL_SECONDS = int(os.getenv("LISTERIA_CACHE_TTL", "300"))
+
+_cache = {}
+_key_locks = {}
+_lock = threading.Lock()
+_generation = 0
+
+
+def _cache_key(*parts):
+    return json.dumps(parts, sort_keys=True, default=str)
+
+
+def _key_lock(key):
+    with _lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def _expired(entry, now):
+    loaded_at, generation, _ = entry
+    return generation != _generation or now - loaded_at > CACHE_TTL_SECONDS
+
+
+def _sweep():
+    # Drops expired entries and the locks of keys with no entry, so keys that
+    # are never looked up again (point histories, heatmaps per date) do not
+    # pile up between uploads. Called with _lock held.
+    now = time.monotonic()
+    for key in [key for key, entry in _cache.items() if _expired(entry, now)]:
+        del _cache[key]
+    for key in [key for key, lock in _key_locks.items() if key not in _cache and not lock.locked()]:
+        del _key_locks[key]
+
+
+def _lookup(key):
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        if _expired(entry, time.monotonic()):
+            _cache.pop(key, None)
+            return None
+        return entry[2]
+
+
+def _cached(key, load):
+    frame = _lookup(key)
+    if frame is not None:
+        return frame
+
+    # Only one session per query shape goes to Mongo; the rest wait for it.
+    with _key_lock(key):
+        frame = _lookup(key)
+        if frame is not None:
+            return frame
+
+        with _lock:
+            generation = _generation
+        frame = load()
+
+        with _lock:
+            # A write that landed while we were reading makes this frame stale.
+            if generation == _generation:
+                _cache[key] = (time.monotonic(), generation, frame)
+    with _lock:
+        _sweep()
+    return frame
+
+
+def load_frame(collection, query=None, projection=None, schema=None):
+    # With a schema (see utils.schema) only the declared fields are fetched
+    # and the columns come back typed.
+    if schema is not None:
+        projection = projection_for(schema)
+
+    def load():
+        if schema is not None and SNAPSHOTS_ENABLED:
+            try:
+                # Cold starts read the on-disk snapshot plus newer documents only
+                return load_snapshot(collection, query, schema)
+            except OSError:
+                pass
+        if schema is not None:
+            # Raw BSON batches decoded straight into typed columns
+            return load_columns(collection, query, schema)
+        return pd.DataFrame(list(collection.find(query or {}, projection)))
+
+    return _cached(_cache_key("find", collection.full_name, query or {}, projection, schema), load)
+
+
+def load_aggregate(collection, pipeline, columns=None):
+    def load():
+        return pd.DataFrame(list(collection.aggregate(pipeline)), columns=columns)
+
+    return _cached(_cache_key("aggregate", collection.full_name, pipeline, columns), load)
+
+
+def load_derived(name, collection, query, build):
+    # Objects computed from a find (e.g. the map pages' rolling counts) are
+    # cached next to the frames and share their TTL and invalidation
+    return _cached(_cache_key("derived", name, collection.full_name, query or {}), build)
+
+
+def invalidate_listeria(rewritten=False):
+    # rewritten=True for in-place edits of existing samples, which the
+    # snapshots' high-water mark cannot see
+    global _generation
+    with _lock:
+        _generation += 1
+        _cache.clear()
+        _sweep()
+    if rewritten:
+        drop_snapshots()
+
+
+def cache_info():
+    with _lock:
+        now = time.monotonic()
+        return {
+            "entries": len(_cache),
+            "generation": _generation,
+            "ttl_seconds": CACHE_TTL_SECONDS,
+            "ages_seconds": [round(now - loaded_at, 1) for loaded_at, _, _ in _cache.values()],
+        }
@@ -1,14 +1,169 @@
-
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
+from pymongo.errors import PyMongoError
 from dotenv import load_dotenv
+import logging
 import os
+import threading
+import time
+
+from utils.constants import LOCATIONS_COLLECTION, ZONES_COLLECTION
+from utils.indexes import ensure_indexes
 
 load_dotenv()
-MONGO_URI = os.getenv("MONGO_URI")
 
-client = MongoClient(MONGO_URI)
-db = client["koral"]
+
+def _mongo_uri():
+    uri = os.getenv("MONGO_URI")
+    if uri:
+        return uri
+    # Streamlit Cloud deployments keep the URI in secrets.toml instead of .env
+    try:
+        import streamlit as st
+        return st.secrets["MONGO_URI"]
+    except Exception:
+        return None
+
+
+MONGO_URI = _mongo_uri()
+MONGO_DB = os.getenv("MONGO_DB", "koral")
+
+# Pool settings, overridable per deployment through the environment
+POOL_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+    "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+    "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000")),
+    "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000")),
+    "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000")),
+    "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000")),
+    "readPreference": os.getenv("MONGO_READ_PREFERENCE", "primary"),
+}
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    # Counts connection churn and checkout waits across every session in the process
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = threading.local()
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+
+    def _finish_wait(self):
+        started = getattr(self._pending, "started", None)
+        self._pending.started = None
+        if started is None:
+            return 0.0
+        return (time.perf_counter() - started) * 1000
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.closed += 1
+
+    def connection_check_out_started(self, event):
+        self._pending.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._finish_wait()
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        waited = self._finish_wait()
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.wait_total_ms += waited
+            self.wait_max_ms = max(self.wait_max_ms, waited)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "checked_out": self.checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "connections_created": self.created,
+                "connections_closed": self.closed,
+                "connections_open": self.created - self.closed,
+                "pool_clears": self.pool_clears,
+                "wait_avg_ms": round(self.wait_total_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max_ms, 3),
+            }
+
+
+pool_metrics = PoolMetrics()
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # One pooled client per process, shared by every page and session
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(MONGO_URI, event_listeners=[pool_metrics], **POOL_OPTIONS)
+    return _client
+
+
+def get_db():
+    return get_client()[MONGO_DB]
+
+
+def pool_stats():
+    stats = pool_metrics.snapshot()
+    stats["max_pool_size"] = POOL_OPTIONS["maxPoolSize"]
+    return stats
+
+
+def _bootstrap_indexes(database):
+    # Runs once per process (on first import); create_index is a no-op for
+    # indexes that already exist. MONGO_ENSURE_INDEXES=0 skips it.
+    if os.getenv("MONGO_ENSURE_INDEXES", "1") == "0":
+        return
+    try:
+        ensure_indexes(database)
+    except PyMongoError as e:
+        logging.getLogger(__name__).warning("Could not ensure MongoDB indexes: %s", e)
+
+
+client = get_client()
+db = get_db()
+_bootstrap_indexes(db)
 
 users_collection = db["users"]
 # listeria_collection = db["fresh"]
 listeria_collection = db["listeria"]
+locations_collection = db[LOCATIONS_COLLECTION]
+zones_collection = db[ZONES_COLLECTION]
@@ -0,0 +1,246 @@
+import base64
+import hashlib
+import json
+import math
+import os
+import threading
+from io import BytesIO
+
+from PIL import Image
+
+try:
+    import cv2
+except ImportError:  # without OpenCV the maps fall back to the single image
+    cv2 = None
+
+# Floor-plan backgrounds for the map pages. Each image is read, downscaled and
+# encoded once per process, then written next to the app as a static file
+# whose name carries the content hash, so the browser fetches it once and a
+# replaced floor plan gets a new URL. Layout coordinates stay in the original
+# pixel size, so a downscaled image still lines up with the sample x/y.
+#
+# Streamlit serves ./static at app/static/ when server.enableStaticServing is
+# on (.streamlit/config.toml). FLOORPLAN_INLINE=1 embeds the encoded image as
+# a data URI instead, for deployments without static serving.
+FLOORPLAN_STATIC_DIR = os.getenv("FLOORPLAN_STATIC_DIR", os.path.join("static", "floorplans"))
+FLOORPLAN_STATIC_URL = os.getenv("FLOORPLAN_STATIC_URL", "app/static/floorplans")
+FLOORPLAN_MAX_WIDTH = int(os.getenv("FLOORPLAN_MAX_WIDTH", "1280"))
+FLOORPLAN_FORMAT = os.getenv("FLOORPLAN_FORMAT", "webp").lower()
+FLOORPLAN_QUALITY = int(os.getenv("FLOORPLAN_QUALITY", "80"))
+FLOORPLAN_INLINE = os.getenv("FLOORPLAN_INLINE", "0") == "1"
+
+# Tile pyramid: level 0 is full resolution and every next level halves it,
+# down to a single tile. A view loads the level nearest to FLOORPLAN_VIEW_WIDTH
+# screen pixels across it, and only the tiles it covers.
+FLOORPLAN_TILES = cv2 is not None and os.getenv("FLOORPLAN_TILES", "1") != "0"
+FLOORPLAN_TILE_SIZE = int(os.getenv("FLOORPLAN_TILE_SIZE", "256"))
+FLOORPLAN_VIEW_WIDTH = int(os.getenv("FLOORPLAN_VIEW_WIDTH", "800"))
+
+_MIME_TYPES = {"webp": "image/webp", "png": "image/png", "jpeg": "image/jpeg"}
+
+# path -> (stat signature, content hash, (source, (width, height)))
+_plans = {}
+# content hash -> pyramid manifest
+_pyramids = {}
+_lock = threading.Lock()
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:16]
+
+
+def _stat_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _encode(image, fmt):
+    buffered = BytesIO()
+    if fmt == "webp":
+        image.save(buffered, format="WEBP", quality=FLOORPLAN_QUALITY, method=6)
+    elif fmt == "jpeg":
+        image.convert("RGB").save(buffered, format="JPEG", quality=FLOORPLAN_QUALITY, optimize=True)
+    else:
+        image.save(buffered, format="PNG", optimize=True)
+    return buffered.getvalue()
+
+
+def _build(path, digest):
+    image = Image.open(path)
+    size = image.size
+    if FLOORPLAN_MAX_WIDTH and image.width > FLOORPLAN_MAX_WIDTH:
+        scaled_height = round(image.height * FLOORPLAN_MAX_WIDTH / image.width)
+        image = image.resize((FLOORPLAN_MAX_WIDTH, scaled_height), Image.LANCZOS)
+    fmt = FLOORPLAN_FORMAT if FLOORPLAN_FORMAT in _MIME_TYPES else "png"
+    data = _encode(image, fmt)
+
+    if FLOORPLAN_INLINE:
+        source = f"data:{_MIME_TYPES[fmt]};base64,{base64.b64encode(data).decode()}"
+        return source, size
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    name = f"{stem}-{digest}-{image.width}.{fmt}"
+    target = os.path.join(FLOORPLAN_STATIC_DIR, name)
+    if not os.path.exists(target):
+        os.makedirs(FLOORPLAN_STATIC_DIR, exist_ok=True)
+        with open(target + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(target + ".tmp", target)
+    return f"{FLOORPLAN_STATIC_URL}/{name}", size
+
+
+def _current(path):
+    # (stat signature, content hash) of path, re-hashing only when the file
+    # changed on disk; None if the file is missing. Call with _lock held.
+    try:
+        signature = _stat_signature(path)
+    except OSError:
+        return None
+    cached = _plans.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached
+    digest = file_hash(path)
+    if cached is not None and cached[1] == digest:
+        cached = (signature, digest, cached[2])
+    else:
+        cached = (signature, digest, None)
+    _plans[path] = cached
+    return cached
+
+
+def floor_plan(path):
+    # Returns (image source for a Plotly layout image, (width, height) of the
+    # original), or None if the file is missing. Reruns only stat the file;
+    # it is re-hashed when it changes on disk and re-encoded when its
+    # content does.
+    with _lock:
+        current = _current(path)
+        if current is None:
+            return None
+        signature, digest, plan = current
+        if plan is None:
+            plan = _build(path, digest)
+            _plans[path] = (signature, digest, plan)
+        return plan
+
+
+def _build_pyramid(path, digest):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    name = f"{stem}-{digest}-{FLOORPLAN_TILE_SIZE}"
+    folder = os.path.join(FLOORPLAN_STATIC_DIR, "tiles", name)
+    manifest_path = os.path.join(folder, "manifest.json")
+    try:
+        # Built by an earlier process
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise OSError(f"Cannot read floor plan {path}")
+    height, width = image.shape[:2]
+    size = FLOORPLAN_TILE_SIZE
+    levels = []
+    level, scale = image, 1.0
+    while True:
+        rows, cols = -(-level.shape[0] // size), -(-level.shape[1] // size)
+        tiles = []
+        os.makedirs(os.path.join(folder, str(len(levels))), exist_ok=True)
+        for row in range(rows):
+            for col in range(cols):
+                tile = level[row * size:(row + 1) * size, col * size:(col + 1) * size]
+                tile_name = f"{len(levels)}/{row}_{col}.webp"
+                cv2.imwrite(os.path.join(folder, tile_name), tile, [cv2.IMWRITE_WEBP_QUALITY, FLOORPLAN_QUALITY])
+                # Tile extent in original pixels
+                tiles.append({
+                    "source": f"{FLOORPLAN_STATIC_URL}/tiles/{name}/{tile_name}",
+                    "x0": col * size / scale,
+                    "y0": row * size / scale,
+                    "x1": min((col * size + tile.shape[1]) / scale, width),
+                    "y1": min((row * size + tile.shape[0]) / scale, height),
+                })
+        levels.append({"scale": scale, "tiles": tiles})
+        if rows == 1 and cols == 1:
+            break
+        # Halve with area averaging (cv2.pyrDown blurs more than needed)
+        level = cv2.resize(level, ((level.shape[1] + 1) // 2, (level.shape[0] + 1) // 2), interpolation=cv2.INTER_AREA)
+        scale /= 2
+
+    manifest = {"size": [width, height], "levels": levels}
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest
+
+
+def tile_pyramid(path):
+    # Pyramid manifest for path (built once per content hash), or None if the
+    # file is missing or tiling is unavailable
+    if not FLOORPLAN_TILES or FLOORPLAN_INLINE:
+        return None
+    with _lock:
+        current = _current(path)
+        if current is None:
+            return None
+        digest = current[1]
+        if digest not in _pyramids:
+            _pyramids[digest] = _build_pyramid(path, digest)
+        return _pyramids[digest]
+
+
+def tiles_in_view(pyramid, view=None, display_width=FLOORPLAN_VIEW_WIDTH):
+    # Tiles of the level nearest to display_width pixels across view (x0, y0,
+    # x1, y1 in original pixels; default the whole plan), keeping only tiles
+    # that overlap it. Levels halve, so the nearest is the coarsest within a
+    # factor of sqrt(2) of the scale needed.
+    width, height = pyramid["size"]
+    x0, y0, x1, y1 = view or (0, 0, width, height)
+    needed = display_width / max(x1 - x0, 1)
+    level = pyramid["levels"][0]
+    for candidate in pyramid["levels"]:
+        if candidate["scale"] >= needed / math.sqrt(2):
+            level = candidate
+    return [
+        tile for tile in level["tiles"]
+        if tile["x1"] > x0 and tile["x0"] < x1 and tile["y1"] > y0 and tile["y0"] < y1
+    ]
+
+
+def layout_images(path, view=None, display_width=FLOORPLAN_VIEW_WIDTH):
+    # Plotly layout images for the floor plan, in a y-up axis whose top edge is
+    # the plan height (the map pages plot height - y): the tiles in view, or
+    # the single encoded image when tiling is off
+    pyramid = tile_pyramid(path)
+    if pyramid is None:
+        plan = floor_plan(path)
+        if plan is None:
+            return []
+        source, (width, height) = plan
+        return [dict(source=source, xref="x", yref="y", x=0, y=height,
+                     sizex=width, sizey=height, sizing="contain", layer="below")]
+
+    height = pyramid["size"][1]
+    return [
+        dict(source=tile["source"], xref="x", yref="y", x=tile["x0"], y=height - tile["y0"],
+             sizex=tile["x1"] - tile["x0"], sizey=tile["y1"] - tile["y0"], sizing="stretch", layer="below")
+        for tile in tiles_in_view(pyramid, view, display_width)
+    ]
+
+
+def view_from_selection(selection, size):
+    # Original-pixel view (x0, y0, x1, y1) of the last box selected on a map
+    # chart (y-up axis), or None when nothing usable is selected
+    boxes = (selection or {}).get("box") or []
+    if not boxes:
+        return None
+    xs, ys = boxes[-1].get("x"), boxes[-1].get("y")
+    if not xs or not ys:
+        return None
+    width, height = size
+    x0, x1 = max(min(xs), 0), min(max(xs), width)
+    y0, y1 = max(height - max(ys), 0), min(height - min(ys), height)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1, y1
@@ -0,0 +1,56 @@
+import base64
+import os
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:  # without OpenCV the maps offer no heatmap
+    cv2 = None
+
+# Kernel-density heatmap of positivity over a floor plan. The weighted points
+# are binned into a raster a few hundred pixels wide and smoothed with one
+# Gaussian blur, which is the kernel density estimate on that raster. The
+# result is colour-mapped into a single semi-transparent PNG drawn between
+# the floor plan and the markers.
+HEATMAP_AVAILABLE = cv2 is not None
+HEATMAP_WIDTH = int(os.getenv("HEATMAP_WIDTH", "400"))
+HEATMAP_OPACITY = float(os.getenv("HEATMAP_OPACITY", "0.6"))
+
+
+def density_raster(x, y, weights, size, bandwidth, raster_width=HEATMAP_WIDTH):
+    # (rows, cols) density over a floor plan of size (width, height) pixels,
+    # with a Gaussian kernel of bandwidth plan pixels. Scaled so an isolated
+    # point of weight 1 peaks at 1; clipped to [0, 1].
+    width, height = size
+    scale = min(raster_width / width, 1.0) if width else 1.0
+    shape = (max(round(height * scale), 1), max(round(width * scale), 1))
+    x, y, weights = (np.asarray(values, dtype=float) for values in (x, y, weights))
+    keep = np.isfinite(x) & np.isfinite(y) & (weights > 0)
+    cols = np.clip((x[keep] * scale).astype(np.int64), 0, shape[1] - 1)
+    rows = np.clip((y[keep] * scale).astype(np.int64), 0, shape[0] - 1)
+    grid = np.bincount(rows * shape[1] + cols, weights=weights[keep], minlength=shape[0] * shape[1])
+    grid = grid.reshape(shape).astype(np.float32)
+    sigma = max(bandwidth * scale, 0.5)
+    density = cv2.GaussianBlur(grid, (0, 0), sigmaX=sigma, sigmaY=sigma, borderType=cv2.BORDER_CONSTANT)
+    return np.clip(density * (2 * np.pi * sigma ** 2), 0, 1)
+
+
+def heatmap_image(density, opacity=HEATMAP_OPACITY):
+    # PNG data URI: jet colours, alpha rising with density, clear where ~0
+    levels = (density * 255).astype(np.uint8)
+    colours = cv2.applyColorMap(levels, cv2.COLORMAP_JET)
+    alpha = (density * opacity * 255).astype(np.uint8)
+    alpha[levels < 5] = 0
+    ok, png = cv2.imencode(".png", np.dstack([colours, alpha]))
+    if not ok:
+        raise ValueError("Cannot encode heatmap")
+    return "data:image/png;base64," + base64.b64encode(png.tobytes()).decode()
+
+
+def heatmap_layer(source, size):
+    # Plotly layout image stretched over the whole plan (y-up axis, like
+    # utils.floorplan.layout_images); add it after the floor plan images
+    width, height = size
+    return dict(source=source, xref="x", yref="y", x=0, y=height,
+                sizex=width, sizey=height, sizing="stretch", layer="below")
@@ -0,0 +1,117 @@
+import sys
+from datetime import date
+
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+
+from utils.constants import LOCATIONS_COLLECTION, NATURAL_KEY, NATURAL_KEY_FILTER, ROLLUP_COLLECTION, ROLLUP_KEYS, ZONES_COLLECTION
+from utils.map_registry import MAP_DEPARTMENTS, map_query, point_history_query
+
+# Indexes every page query relies on, created once per process at startup.
+# collection -> list of (keys, options)
+INDEXES = {
+    "listeria": [
+        ([("fresh_smoked", ASCENDING), ("sample_date", ASCENDING)], {}),
+        ([("location_code", ASCENDING)], {}),
+        ([("points", ASCENDING), ("sample_date", ASCENDING)], {}),
+        # Point history of samples stored under the legacy "point" field
+        ([("point", ASCENDING), ("sample_date", ASCENDING)], {}),
+        # Upload upserts, over samples with every key field; fails to build
+        # while duplicates from earlier uploads remain (see
+        # utils.ingest.remove_duplicate_samples)
+        ([(field, ASCENDING) for field in NATURAL_KEY], {"unique": True, "partialFilterExpression": NATURAL_KEY_FILTER}),
+        # Upload key lookup, which the partial index above cannot serve
+        ([("sample_code", ASCENDING)], {}),
+    ],
+    LOCATIONS_COLLECTION: [
+        ([("location_code", ASCENDING)], {"unique": True}),
+    ],
+    ZONES_COLLECTION: [
+        ([("area", ASCENDING), ("name", ASCENDING)], {"unique": True}),
+    ],
+    "users": [
+        ([("username", ASCENDING)], {"unique": True}),
+    ],
+    ROLLUP_COLLECTION: [
+        ([(key, ASCENDING) for key in ROLLUP_KEYS], {"unique": True}),
+    ],
+}
+
+# Filtered queries issued by the pages, checked by verify_query_plans().
+# Whole-collection reads (the Trend rollup scan, the Admin CSV export) scan by
+# design and are not listed.
+PAGE_QUERIES = [
+    ("Map samples", "listeria", "find", map_query()),
+    ("Map point history", "listeria", "find",
+     point_history_query(next(iter(MAP_DEPARTMENTS)), "__probe__", ["__probe__"], date.today(), 28)),
+    ("Admin location codes", "listeria", "distinct", "location_code"),
+    ("Admin upload key lookup", "listeria", "find", {"sample_code": {"$in": ["__probe__"]}}),
+    ("Admin X/Y update", LOCATIONS_COLLECTION, "update", {"location_code": "__probe__"}),
+    ("Login user lookup", "users", "find", {"username": "__probe__"}),
+]
+
+
+def ensure_indexes(db):
+    # An index the server refuses to build (e.g. a unique one over duplicated
+    # data) does not stop the others; the first refusal is raised at the end
+    created, failures = [], []
+    for name, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                created.append(db[name].create_index(keys, **options))
+            except OperationFailure as e:
+                failures.append(e)
+    if failures:
+        raise failures[0]
+    return created
+
+
+def _explain(db, collection, kind, spec):
+    if kind == "find":
+        return db[collection].find(spec).explain()
+    if kind == "distinct":
+        return db.command("explain", {"distinct": collection, "key": spec}, verbosity="queryPlanner")
+    if kind == "update":
+        update = {"q": spec, "u": {"$set": {"x": 0, "y": 0}}, "multi": True}
+        return db.command("explain", {"update": collection, "updates": [update]}, verbosity="queryPlanner")
+    raise ValueError(f"Unknown query kind '{kind}'")
+
+
+def _plan_stages(plan):
+    # Walks a winning plan (classic or SBE layout) and yields every stage name
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _plan_stages(value)
+
+
+def verify_query_plans(db):
+    # Explains every page query; raises RuntimeError if any of them would
+    # fall back to a collection scan.
+    report = []
+    for label, collection, kind, spec in PAGE_QUERIES:
+        explained = _explain(db, collection, kind, spec)
+        winning = explained.get("queryPlanner", {}).get("winningPlan", {})
+        report.append((label, list(dict.fromkeys(_plan_stages(winning)))))
+
+    scans = [label for label, stages in report if "COLLSCAN" in stages]
+    if scans:
+        raise RuntimeError(f"Queries falling back to COLLSCAN: {', '.join(scans)}")
+    return report
+
+
+if __name__ == "__main__":
+    from utils.db import get_db
+
+    try:
+        db = get_db()
+        ensure_indexes(db)
+        for label, stages in verify_query_plans(db):
+            print(f"{label}: {' -> '.join(stages)}")
+    except (PyMongoError, RuntimeError) as e:
+        print(f"Index check failed: {e}", file=sys.stderr)
+        sys.exit(1)
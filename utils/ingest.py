@@ -0,0 +1,200 @@
+import os
+import time
+
+import pandas as pd
+from pymongo import InsertOne, UpdateOne
+
+from utils.constants import NATURAL_KEY, NATURAL_KEY_FILTER
+from utils.locations import position_conflicts, register_locations, without_coordinates
+from utils.rollup import apply_to_rollup
+from utils.schema import as_text
+
+# Streaming upload of a lab results CSV. The file is parsed in chunks of
+# INGEST_CHUNK_ROWS rows; each chunk is validated, typed and written on its
+# own (locations registered, samples upserted unordered, rollup adjusted),
+# so memory stays at about one chunk whatever the size of the file.
+#
+# Samples are identified by their natural key (NATURAL_KEY, unique index in
+# utils.indexes), so uploading an overlapping export again updates the
+# samples that changed instead of duplicating them. Each chunk's stored
+# samples are fetched with one query and compared in memory; only new and
+# changed rows are written. Rows missing a key field cannot be matched and
+# are inserted as they come.
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "5000"))
+
+# Per-chunk outcome counts, in report order. skipped: rows superseded by a
+# later row of the chunk with the same key; conflicting: rows whose x/y
+# differ from their registered location (the registry position is kept).
+INGEST_COUNTS = ["inserted", "updated", "unchanged", "skipped", "conflicting"]
+
+REQUIRED_COLUMNS = {
+    "sample_code", "sample_description", "translated_description", "test_code", "test_result", "unit",
+    "analytical_report_code", "sample_date", "location_code", "fresh_smoked", "sub_area",
+    "before_during", "value", "week_num", "week", "x", "y", "points"
+}
+
+SAMPLE_DATE_FORMAT = "%d-%m-%Y"
+
+# Code columns are read as text. pandas infers types per chunk, so a code
+# column would otherwise be int in one chunk and text in the next (one "L3"
+# is enough), and the same sample would be stored both ways.
+CODE_COLUMNS = ["sample_code", "test_code", "analytical_report_code", "location_code", "points", "week"]
+CODE_DTYPES = dict.fromkeys(CODE_COLUMNS, str)
+
+
+def read_chunks(file, chunk_rows=INGEST_CHUNK_ROWS, **kwargs):
+    return pd.read_csv(file, encoding="utf-8", encoding_errors="replace", chunksize=chunk_rows, dtype=CODE_DTYPES, **kwargs)
+
+
+def read_preview(file, rows=5):
+    # First rows of an uploaded file, rewound for the real read
+    preview = pd.read_csv(file, encoding="utf-8", encoding_errors="replace", nrows=rows, dtype=CODE_DTYPES)
+    file.seek(0)
+    return preview
+
+
+def missing_columns(columns):
+    return REQUIRED_COLUMNS - set(columns)
+
+
+def prepare_chunk(chunk, username):
+    # Typed copy of one parsed chunk; raises ValueError on missing columns
+    missing = missing_columns(chunk.columns)
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(sorted(missing))}")
+    chunk = chunk.copy()
+    chunk["sample_date"] = pd.to_datetime(chunk["sample_date"], format=SAMPLE_DATE_FORMAT, errors="coerce")
+    chunk["uploaded_by"] = username
+    return chunk
+
+
+def chunk_records(chunk):
+    # Documents of a prepared chunk. Unparseable dates are stored as null
+    # (NaT cannot be encoded); other empty cells stay NaN as before.
+    records = chunk.to_dict(orient="records")
+    for record in records:
+        if pd.isna(record["sample_date"]):
+            record["sample_date"] = None
+    return records
+
+
+def _key(record):
+    # Natural key as text (codes may be stored as numbers); None if incomplete
+    key = tuple(as_text(record.get(field)) for field in NATURAL_KEY)
+    return None if None in key else key
+
+
+def _same(field, new, stored):
+    if field in CODE_COLUMNS:
+        # Codes compare as text, however an earlier upload typed them
+        return as_text(new) == as_text(stored)
+    if isinstance(new, float) and isinstance(stored, float) and new != new and stored != stored:
+        return True
+    try:
+        return bool(new == stored)
+    except (TypeError, ValueError):
+        return False
+
+
+def stored_samples(collection, keys):
+    # {natural key: stored document} for the given keys, in one query served
+    # by the natural-key index
+    codes = {key[0] for key in keys}
+    stored = list(codes) + [int(code) for code in codes if code.lstrip("-").isdigit()]
+    wanted = set(keys)
+    found = {}
+    for doc in collection.find({"sample_code": {"$in": stored}}):
+        key = _key(doc)
+        if key in wanted:
+            found[key] = doc
+    return found
+
+
+def upsert_chunk(collection, locations, chunk):
+    # New locations go to the registry; samples of registered locations are
+    # stored without x/y. Returns the INGEST_COUNTS of the chunk and the
+    # location codes whose uploaded x/y differ from the registry.
+    registered = register_locations(locations, chunk)
+    conflicts = position_conflicts(locations, chunk)
+    records = without_coordinates(chunk_records(chunk), registered)
+    latest, incomplete = {}, []
+    for row, record in enumerate(records):
+        key = _key(record)
+        if key is None:
+            incomplete.append(row)
+        else:
+            latest[key] = row
+    counts = dict.fromkeys(INGEST_COUNTS, 0)
+    counts["skipped"] = len(records) - len(latest) - len(incomplete)
+    counts["conflicting"] = len(conflicts)
+    conflicting_codes = set(conflicts)
+
+    stored = stored_samples(collection, latest)
+    operations = [InsertOne(records[row]) for row in incomplete]
+    written, replaced = list(incomplete), []
+    for key, row in latest.items():
+        record = records[row]
+        previous = stored.get(key)
+        if previous is None:
+            operations.append(UpdateOne({field: record[field] for field in NATURAL_KEY}, {"$set": record}, upsert=True))
+        elif all(field in previous and _same(field, value, previous[field])
+                 for field, value in record.items() if field != "uploaded_by"):
+            counts["unchanged"] += 1
+            continue
+        else:
+            operations.append(UpdateOne({"_id": previous["_id"]}, {"$set": record}))
+            replaced.append(previous)
+        written.append(row)
+    if not operations:
+        return counts, conflicting_codes
+
+    result = collection.bulk_write(operations, ordered=False)
+    counts["inserted"] = result.inserted_count + result.upserted_count
+    counts["updated"] = result.modified_count
+    counts["unchanged"] += len(operations) - counts["inserted"] - result.modified_count
+    apply_to_rollup(collection, chunk.iloc[written], pd.DataFrame(replaced))
+    return counts, conflicting_codes
+
+
+def ingest_csv(collection, locations, file, username, chunk_rows=INGEST_CHUNK_ROWS):
+    # Streams file into collection one chunk at a time, yielding
+    # (rows read, INGEST_COUNTS, conflicting location codes, seconds) per chunk
+    for chunk in read_chunks(file, chunk_rows):
+        started = time.perf_counter()
+        counts, conflicting_codes = upsert_chunk(collection, locations, prepare_chunk(chunk, username))
+        yield len(chunk), counts, conflicting_codes, time.perf_counter() - started
+
+
+def _codes_as_text(collection):
+    # Rewrites key codes stored as numbers (uploads before the code columns
+    # were read as text) as text, so the unique index covers those samples
+    numeric = {"$or": [{field: {"$type": "number"}} for field in NATURAL_KEY]}
+    operations = []
+    for doc in collection.find(numeric, dict.fromkeys(NATURAL_KEY, 1)):
+        text = {field: as_text(doc[field]) for field in NATURAL_KEY if isinstance(doc.get(field), (int, float)) and not isinstance(doc[field], bool)}
+        text = {field: value for field, value in text.items() if value is not None}
+        if text:
+            operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": text}))
+    for start in range(0, len(operations), INGEST_CHUNK_ROWS):
+        collection.bulk_write(operations[start:start + INGEST_CHUNK_ROWS], ordered=False)
+
+
+def remove_duplicate_samples(collection):
+    # Deletes all but the latest upload of every natural key stored more than
+    # once (samples uploaded before the key was enforced), so the unique
+    # index can be built. Only samples the index covers are grouped; those
+    # missing a code are left alone. Returns the number of deleted samples.
+    _codes_as_text(collection)
+    pipeline = [
+        {"$match": NATURAL_KEY_FILTER},
+        {"$group": {"_id": {field: f"${field}" for field in NATURAL_KEY}, "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    extra = []
+    for group in collection.aggregate(pipeline, allowDiskUse=True):
+        # ObjectIds grow with insertion time
+        extra.extend(sorted(group["ids"])[:-1])
+    deleted = 0
+    for start in range(0, len(extra), INGEST_CHUNK_ROWS):
+        deleted += collection.delete_many({"_id": {"$in": extra[start:start + INGEST_CHUNK_ROWS]}}).deleted_count
+    return deleted
@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+from pymongo import UpdateOne
+
+from utils.bson_loader import load_columns
+from utils.constants import LOCATIONS_COLLECTION
+from utils.data import load_derived
+from utils.map_registry import MAP_DEPARTMENTS, area_for
+from utils.schema import as_text
+
+# Sampling locations: one document per location_code with its sampling point,
+# floor-plan position, sub area, department and floor plan image. Samples are
+# joined to it at read time (join_locations), so moving a location is a
+# single-document write and new samples are stored without x/y.
+#
+# Samples of a location_code that is not registered keep their own x/y, so
+# the maps work the same before and after the registry is built.
+
+LOCATION_FIELDS = {
+    "location_code": "str",
+    "points": "str",
+    "x": "float32",
+    "y": "float32",
+    "sub_area": "category",
+    "fresh_smoked": "category",
+    "floor_plan": "str",
+}
+
+
+def locations_collection_for(collection):
+    return collection.database[LOCATIONS_COLLECTION]
+
+
+def load_locations(collection):
+    # The whole registry (a few hundred rows), cached with the frames
+    def load():
+        locations = load_columns(collection, {}, LOCATION_FIELDS)
+        locations = locations.dropna(subset=["location_code"]).drop_duplicates("location_code", keep="last")
+        return locations.reset_index(drop=True)
+
+    return load_derived("locations", collection, {}, load)
+
+
+def join_locations(frame, locations):
+    # Copy of frame with x/y (and missing points) taken from the registry by
+    # location_code; unregistered codes keep the sample's own values
+    frame = frame.copy()
+    if locations.empty or "location_code" not in frame.columns:
+        return frame
+    codes = frame["location_code"]
+    if isinstance(codes.dtype, pd.CategoricalDtype):
+        # One lookup per distinct code, then a take over the int codes
+        positions = pd.Index(locations["location_code"]).get_indexer(codes.cat.categories.astype(str))
+        # code -1 (missing) picks the trailing -1
+        rows = np.append(positions, -1)[codes.cat.codes.to_numpy()]
+    else:
+        rows = pd.Index(locations["location_code"]).get_indexer(codes.map(as_text, na_action="ignore"))
+    found = rows >= 0
+    for field in ("x", "y"):
+        registered = locations[field].to_numpy()[np.where(found, rows, 0)]
+        if field in frame.columns:
+            own = frame[field].to_numpy(dtype=registered.dtype, na_value=np.nan)
+            frame[field] = np.where(found & ~np.isnan(registered), registered, own)
+        else:
+            frame[field] = np.where(found, registered, np.nan).astype(registered.dtype)
+    if "points" in frame.columns:
+        registered = pd.Series(locations["points"].to_numpy(dtype=object)[np.where(found, rows, 0)], index=frame.index)
+        fill = frame["points"].isna() & found & registered.notna()
+        if fill.any():
+            points = frame["points"]
+            if isinstance(points.dtype, pd.CategoricalDtype):
+                points = points.cat.add_categories(sorted(set(registered[fill]) - set(points.cat.categories)))
+            frame["points"] = points.mask(fill, registered)
+    return frame
+
+
+def location_rows(frame):
+    # One registry row per location_code of a sample frame (upload or
+    # collection): the latest non-missing value of each field
+    placed = frame.dropna(subset=["location_code", "x", "y"])
+    if "sample_date" in placed.columns:
+        placed = placed.sort_values("sample_date", kind="stable")
+    columns = [field for field in LOCATION_FIELDS if field in placed.columns and field != "location_code"]
+    latest = placed.groupby(placed["location_code"].map(as_text), sort=True)[columns].last()
+    rows = []
+    for code, values in latest.iterrows():
+        row = {"location_code": code, "x": float(values["x"]), "y": float(values["y"])}
+        for field in ("points", "sub_area", "fresh_smoked"):
+            if field in values and pd.notna(values[field]):
+                row[field] = as_text(values[field])
+        area = area_for(row)
+        if area is not None:
+            row["floor_plan"] = MAP_DEPARTMENTS[area]["floor_plan"]
+        rows.append(row)
+    return rows
+
+
+def register_locations(collection, frame, overwrite=False):
+    # Upserts the locations of frame. Existing entries are left alone unless
+    # overwrite; returns the location codes now in the registry.
+    rows = location_rows(frame)
+    if not rows:
+        return set()
+    operator = "$set" if overwrite else "$setOnInsert"
+    collection.bulk_write(
+        [UpdateOne({"location_code": row["location_code"]}, {operator: row}, upsert=True) for row in rows],
+        ordered=False,
+    )
+    return {row["location_code"] for row in rows}
+
+
+def position_conflicts(collection, frame):
+    # Location code of every row of frame whose x/y differ from its registry
+    # entry. Uploads keep the registered position and store such samples
+    # without x/y, so the difference is reported rather than applied.
+    placed = frame.dropna(subset=["location_code", "x", "y"])
+    if placed.empty:
+        return pd.Series([], dtype=object)
+    codes = placed["location_code"].map(as_text)
+    registry = pd.DataFrame(list(collection.find(
+        {"location_code": {"$in": codes.unique().tolist()}}, {"_id": 0, "location_code": 1, "x": 1, "y": 1},
+    )))
+    if registry.empty:
+        return pd.Series([], dtype=object)
+    registry = registry.drop_duplicates("location_code").set_index("location_code")
+    registered = registry.reindex(codes.to_numpy())
+    moved = np.zeros(len(placed), dtype=bool)
+    for field in ("x", "y"):
+        stored = pd.to_numeric(registered[field], errors="coerce").to_numpy(dtype=float)
+        given = pd.to_numeric(placed[field], errors="coerce").to_numpy(dtype=float)
+        moved |= ~np.isnan(stored) & ~np.isclose(given, stored, rtol=0, atol=1e-6)
+    return codes[moved]
+
+
+def set_location(collection, samples, location_code, x, y):
+    # Moves one location: a single registry write. A code that is not
+    # registered yet takes its other fields from one of its samples.
+    defaults = {"location_code": location_code}
+    sample = samples.find_one({"location_code": location_code}, {"points": 1, "sub_area": 1, "fresh_smoked": 1})
+    for field in ("points", "sub_area", "fresh_smoked"):
+        if sample and sample.get(field) is not None:
+            defaults[field] = as_text(sample[field])
+    area = area_for(defaults)
+    if area is not None:
+        defaults["floor_plan"] = MAP_DEPARTMENTS[area]["floor_plan"]
+    return collection.update_one(
+        {"location_code": location_code},
+        {"$set": {"x": float(x), "y": float(y)}, "$setOnInsert": defaults},
+        upsert=True,
+    )
+
+
+def without_coordinates(records, registered):
+    # Sample records to insert, minus x/y for registered locations
+    return [
+        {field: value for field, value in record.items() if field not in ("x", "y")}
+        if as_text(record.get("location_code")) in registered else record
+        for record in records
+    ]
+
+
+def build_registry(collection, samples, strip_samples=False):
+    # Registers every location found on the samples, taking the latest x/y
+    # per code. strip_samples also removes x/y from the registered samples.
+    # Returns (registered locations, stripped samples).
+    frame = pd.DataFrame(list(samples.find(
+        {"location_code": {"$ne": None}, "x": {"$exists": True}, "y": {"$exists": True}},
+        {"_id": 0, "location_code": 1, "points": 1, "x": 1, "y": 1, "sub_area": 1, "fresh_smoked": 1, "sample_date": 1},
+    )))
+    if frame.empty:
+        return 0, 0
+    registered = register_locations(collection, frame, overwrite=True)
+    stripped = 0
+    if strip_samples and registered:
+        # Codes may be stored as numbers on older samples
+        stored = frame["location_code"].drop_duplicates().tolist()
+        stripped = samples.update_many(
+            {"location_code": {"$in": stored}}, {"$unset": {"x": "", "y": ""}}
+        ).modified_count
+    return len(registered), stripped
@@ -0,0 +1,538 @@
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import streamlit as st
+
+from utils.bson_loader import load_columns
+from utils.data import load_derived, load_frame
+from utils.floorplan import floor_plan, layout_images, view_from_selection
+from utils.heatmap import HEATMAP_AVAILABLE, density_raster, heatmap_image, heatmap_layer
+from utils.locations import join_locations, load_locations, locations_collection_for
+from utils.map_registry import MAP_DEPARTMENTS, filter_fields, map_query, point_history_query
+from utils.positivity import DEFAULT_WINDOW, WINDOW_OPTIONS, RollingCounts
+from utils.schema import MAP_FIELDS, POINT_HISTORY_FIELDS
+from utils.spatial import PointGrid, spread_scores
+from utils.zones import assign_zones, load_zones, zone_positivity, zone_shapes, zones_collection_for
+
+# The floor-plan map pages. Every area in MAP_DEPARTMENTS is drawn from one
+# shared load: a single find for all areas, split into per-area frames, and a
+# single RollingCounts keyed by (department, point). Sample positions are
+# joined from the location registry (utils/locations.py). Both are built once
+# per data load (cached with the frames), the floor plans once per process.
+#
+# Playback animates a range of dates client-side: every frame (dot colours
+# and positivity per point for one date) is cut from the rolling grid in one
+# pass and sent with the figure, the floor plan once in its layout, so
+# scrubbing and playing never rerun the page.
+#
+# Markers carry only their point code, positivity and colour. A point's
+# sample history is fetched when it is clicked, with one indexed per-point
+# query, and shown next to the map.
+#
+# Above MAP_WEBGL_THRESHOLD markers the maps draw with WebGL (Scattergl), one
+# trace per colour class, instead of one SVG node per marker.
+#
+# The spread colouring asks whether a point's neighbourhood is trending
+# positive: each point's positivity is blended with its neighbours' within
+# the area's spread_radius, weighted by distance (utils/spatial.py). The
+# neighbour pairs are found once per data load on a grid index.
+#
+# The heatmap overlay is a kernel density of the points weighted by their
+# positivity (utils/heatmap.py), cached per (area, date, window).
+#
+# Zones are admin-drawn polygons per area (utils/zones.py). Points are
+# assigned to them once per data load, so zone positivity is one groupby.
+
+SEVERE_COLOR = "#8B0000"  # blood red
+HIGH_COLOR = "#FF0000"  # red
+LOW_COLOR = "#FFBF00"  # amber
+CLEAR_COLOR = "#008000"  # green
+NO_DATA_COLOR = "#A9A9A9"  # gray, no sample in the window
+
+# Playback: sampling dates preselected in the range, milliseconds per frame
+PLAYBACK_DEFAULT_DATES = 30
+PLAYBACK_FRAME_MS = 500
+
+MAP_WEBGL_THRESHOLD = int(os.getenv("MAP_WEBGL_THRESHOLD", "1000"))
+
+HISTORY_LABELS = {1: ":red[**Detected**]", 0: ":green[**Not Detected**]"}
+
+
+def map_schema():
+    return {**MAP_FIELDS, **{field: "category" for field in filter_fields() if field not in MAP_FIELDS}}
+
+
+class MapData:
+    def __init__(self, frame, zones=None):
+        # Samples without a position in the registry or on the document are
+        # not drawn
+        frame = frame.dropna(subset=["x", "y"])
+        self.frames = {}
+        # Sampling dates per area as datetime.date, for the date picker
+        self.dates = {}
+        # Last known x/y and location code per point, for playback and the
+        # spread score
+        self.positions = {}
+        self.grids = {}
+        # (i, j, distance) neighbour pairs per area, indexing positions
+        self.neighbours = {}
+        # Zone polygons per area and the zone of every placed point
+        self.zones = {}
+        self.point_zones = {}
+        parts = []
+        for key, entry in MAP_DEPARTMENTS.items():
+            mask = np.ones(len(frame), dtype=bool)
+            for field, value in entry["filter"].items():
+                mask &= frame[field].eq(value).fillna(False).to_numpy(dtype=bool)
+            part = frame[mask]
+            self.frames[key] = part
+            days = np.unique(part["sample_date"].dropna().to_numpy().astype("datetime64[D]"))
+            self.dates[key] = list(pd.DatetimeIndex(days).date)
+            placed = part.dropna(subset=["points", "x", "y"]).sort_values("sample_date", kind="stable")
+            self.positions[key] = placed.groupby(placed["points"].astype(str))[["x", "y", "location_code"]].last()
+            radius = entry["spread_radius"]
+            self.grids[key] = PointGrid(self.positions[key]["x"], self.positions[key]["y"], radius)
+            self.neighbours[key] = self.grids[key].pairs(radius)
+            self.zones[key] = (zones or {}).get(key, [])
+            self.point_zones[key] = pd.Series(
+                assign_zones(self.positions[key]["x"], self.positions[key]["y"], self.zones[key]),
+                index=self.positions[key].index, dtype=object,
+            )
+            parts.append(part.assign(department=key))
+        # Areas may overlap, so each one brings its own rows
+        self.rolling = RollingCounts(pd.concat(parts, ignore_index=True), keys=["department", "points"])
+
+    def positivity(self, key, date, window):
+        return _department(self.rolling.positivity(date, window), key)
+
+    def zone_totals(self, key, date, window):
+        # Per zone samples/tested/detected and positivity in the window
+        counts = _department(self.rolling.counts(date, window), key)
+        return zone_positivity(counts, self.point_zones[key])
+
+    def spread(self, key, date, window):
+        # Neighbourhood-weighted positivity per placed point of area key
+        positions = self.positions[key]
+        values = self.positivity(key, date, window).reindex(positions.index).to_numpy(dtype=float)
+        return pd.Series(
+            spread_scores(values, self.neighbours[key], MAP_DEPARTMENTS[key]["spread_radius"]),
+            index=positions.index,
+        )
+
+    def nearby(self, key, point):
+        # [(point, distance)] of the other points within the area's
+        # spread_radius of point, nearest first
+        positions = self.positions[key]
+        if point not in positions.index:
+            return []
+        x, y = positions.loc[point, ["x", "y"]]
+        indices, distances = self.grids[key].within(x, y, MAP_DEPARTMENTS[key]["spread_radius"])
+        return [(positions.index[i], d) for i, d in zip(indices, distances) if positions.index[i] != point]
+
+    def playback(self, key, dates, window, thresholds):
+        # (dates x points) dot colours and positivity labels for every placed
+        # point of area key, in self.positions[key] order
+        positions = self.positions[key]
+        rows = self.rolling.points.get_indexer(
+            pd.MultiIndex.from_arrays([np.full(len(positions), key, dtype=object), positions.index])
+        )
+        found = rows >= 0
+        rows = np.where(found, rows, 0)
+        columns = self.rolling.day_index(dates)
+        samples, tested, detected = (
+            np.where(found[:, None], counts[rows][:, columns], 0).T
+            for counts in self.rolling.window_counts(window)
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(tested > 0, detected / tested, np.nan)
+        present = samples > 0
+        colors = np.where(present, positivity_colors(ratio, thresholds), NO_DATA_COLOR)
+        percents = np.where(present, np.char.add(np.round(ratio * 100, 1).astype(str), "%"), "N/A")
+        return colors, percents
+
+
+def _department(series, key):
+    # Per-point slice of a (department, points) indexed result
+    try:
+        return series.xs(key, level="department")
+    except KeyError:
+        return series.iloc[:0].droplevel("department")
+
+
+def load_map_data(collection):
+    query = map_query()
+    return load_derived(
+        "map_data", collection, query,
+        lambda: MapData(
+            join_locations(
+                load_frame(collection, query, schema=map_schema()),
+                load_locations(locations_collection_for(collection)),
+            ),
+            load_zones(zones_collection_for(collection)),
+        ),
+    )
+
+
+def load_point_history(collection, data, key, point, date, window):
+    # Newest-first samples of one point in the window ending on date, cached
+    # with the frames. The rows are the ones the map counts for the point:
+    # its own, the legacy alias and registry-filled points included.
+    frame = data.frames[key]
+    location_codes = sorted(frame.loc[frame["points"] == point, "location_code"].dropna().astype(str).unique())
+    query = point_history_query(key, point, location_codes, date, window)
+
+    def load():
+        history = join_locations(
+            load_columns(collection, query, POINT_HISTORY_FIELDS),
+            load_locations(locations_collection_for(collection)),
+        )
+        history = history[history["points"] == point]
+        return (
+            history[["sample_date", "value"]]
+            .sort_values("sample_date", ascending=False, kind="stable")
+            .reset_index(drop=True)
+        )
+
+    return load_derived("point_history", collection, query, load)
+
+
+def load_heatmap(collection, data, key, date, window, size):
+    # Heatmap image source for area key on date, cached with the frames
+    entry = MAP_DEPARTMENTS[key]
+
+    def build():
+        positions = data.positions[key]
+        weights = data.positivity(key, date, window).reindex(positions.index).fillna(0)
+        density = density_raster(
+            positions["x"].to_numpy(), positions["y"].to_numpy(), weights.to_numpy(dtype=float),
+            size, entry["heatmap_bandwidth"],
+        )
+        return heatmap_image(density)
+
+    spec = {"area": key, "date": str(date), "window": window, "size": list(size)}
+    return load_derived("heatmap", collection, spec, build)
+
+
+def positivity_colors(ratio, thresholds):
+    # Array of dot colours; NaN (nothing tested yet) compares False
+    # everywhere and stays clear
+    ratio = np.asarray(ratio, dtype=float)
+    conditions = [ratio >= thresholds["severe"], ratio > thresholds["high"], ratio > thresholds["low"]]
+    return np.select(conditions, [SEVERE_COLOR, HIGH_COLOR, LOW_COLOR], default=CLEAR_COLOR)
+
+
+def _window_picker():
+    # Window for the hover history and the positivity colours; switching it
+    # reuses the cached counts
+    window_choice = st.selectbox(
+        "Positivity Window",
+        WINDOW_OPTIONS + ["Custom"],
+        index=WINDOW_OPTIONS.index(DEFAULT_WINDOW),
+        format_func=lambda days: days if days == "Custom" else f"{days} days",
+    )
+    if window_choice == "Custom":
+        return int(st.number_input("Window (days)", min_value=1, max_value=3650, value=DEFAULT_WINDOW, step=1))
+    return window_choice
+
+
+def playback_figure(data, key, dates, window, size):
+    entry = MAP_DEPARTMENTS[key]
+    width, height = size
+    positions = data.positions[key]
+    colors, percents = data.playback(key, dates, window, entry["thresholds"])
+    labels = [str(date) for date in dates]
+    # Colours change per frame, so dense playback keeps one WebGL trace with
+    # per-marker colours; WebGL frames have to redraw
+    webgl = len(positions) > MAP_WEBGL_THRESHOLD
+    scatter = go.Scattergl if webgl else go.Scatter
+
+    fig = go.Figure(
+        data=[scatter(
+            x=positions['x'],
+            y=height - positions['y'],
+            mode='markers',
+            text=positions['location_code'].astype(str),
+            marker=dict(
+                size=12,
+                color=colors[0],
+                line=dict(width=1, color='DarkSlateGrey')
+            ),
+            customdata=percents[0],
+            hovertemplate=(
+                "<b>Location Code:</b> %{text}<br>"
+                + f"<b>{window}-Day Positivity:</b> %{{customdata}}<extra></extra>"
+            )
+        )],
+        # Frames only carry what changes between dates
+        frames=[
+            go.Frame(name=label, traces=[0], data=[scatter(marker=dict(color=colors[i]), customdata=percents[i])])
+            for i, label in enumerate(labels)
+        ],
+    )
+    for image in layout_images(entry["floor_plan"]):
+        fig.add_layout_image(image)
+
+    still = dict(frame=dict(duration=0, redraw=webgl), mode="immediate", transition=dict(duration=0))
+    play = dict(frame=dict(duration=PLAYBACK_FRAME_MS, redraw=webgl), fromcurrent=True, transition=dict(duration=0))
+    fig.update_layout(
+        xaxis=dict(visible=False, range=[0, width]),
+        yaxis=dict(visible=False, range=[0, height]),
+        showlegend=False,
+        margin=dict(l=0, r=0, t=40, b=90),
+        title=f"{entry['title']} Detections, {labels[0]} to {labels[-1]}",
+        updatemenus=[dict(
+            type="buttons", direction="left", showactive=False,
+            x=0, y=0, xanchor="left", yanchor="top", pad=dict(t=50),
+            buttons=[
+                dict(label="▶ Play", method="animate", args=[None, play]),
+                dict(label="⏸ Pause", method="animate", args=[[None], still]),
+            ],
+        )],
+        sliders=[dict(
+            active=0, x=0.15, len=0.85, y=0, yanchor="top", pad=dict(t=30),
+            currentvalue=dict(prefix="Date: "),
+            steps=[dict(label=label, method="animate", args=[[label], still]) for label in labels],
+        )],
+    )
+    return fig
+
+
+def marker_traces(markers, height, window, webgl=None):
+    # markers: x, y, dot_color, location_code, points and positivity columns,
+    # and spread when colouring by spread.
+    # webgl=None picks WebGL above MAP_WEBGL_THRESHOLD markers.
+    if webgl is None:
+        webgl = len(markers) > MAP_WEBGL_THRESHOLD
+    columns = ['points', 'positivity']
+    hovertemplate = "<b>Location Code:</b> %{text}<br>" + f"<b>{window}-Day Positivity:</b> %{{customdata[1]}}"
+    if 'spread' in markers.columns:
+        columns.append('spread')
+        hovertemplate += "<br><b>Neighbourhood Spread:</b> %{customdata[2]}"
+    hovertemplate += "<extra></extra>"
+
+    def trace(group, color, scatter=go.Scatter):
+        return scatter(
+            x=group['x'],
+            y=height - group['y'],
+            mode='markers',
+            marker=dict(
+                size=12,
+                color=color,
+                line=dict(width=1, color='DarkSlateGrey')
+            ),
+            text=group['location_code'].astype(str),
+            customdata=group[columns],
+            hovertemplate=hovertemplate
+        )
+
+    if not webgl:
+        return [trace(markers, markers['dot_color'])]
+    # One WebGL trace per colour class: a handful of draw calls, and no
+    # per-marker colour array
+    return [
+        trace(group, color, scatter=go.Scattergl)
+        for color, group in markers.groupby('dot_color', sort=False)
+    ]
+
+
+def map_figure(markers, size, view, window, title, images=(), webgl=None):
+    width, height = size
+    x0, y0, x1, y1 = view or (0, 0, width, height)
+    fig = go.Figure(data=marker_traces(markers, height, window, webgl))
+    for image in images:
+        fig.add_layout_image(image)
+    fig.update_layout(
+        xaxis=dict(visible=False, range=[x0, x1]),
+        yaxis=dict(visible=False, range=[height - y1, height - y0]),
+        showlegend=False,
+        margin=dict(l=0, r=0, t=40, b=0),
+        title=title
+    )
+    return fig
+
+
+def _history_panel(collection, data, key, point, filtered, date, window):
+    st.subheader("Point history")
+    if point is None:
+        st.caption("Click a point on the map to list its samples.")
+        return
+    locations = filtered.loc[filtered["points"] == point, "location_code"].dropna().astype(str).unique()
+    st.markdown(f"**Point {point}**" + (f" · {', '.join(locations)}" if len(locations) else ""))
+    zone = data.point_zones[key].get(point)
+    if zone is not None:
+        st.markdown(f"Zone: **{zone}**")
+    st.caption(f"Last {window} days to {date}")
+    history = load_point_history(collection, data, key, point, date, window)
+    if history.empty:
+        st.write("No history available")
+    else:
+        lines = [
+            f"{sampled:%Y-%m-%d}: {HISTORY_LABELS.get(value, 'Unknown') if pd.notna(value) else 'Unknown'}"
+            for sampled, value in zip(history["sample_date"], history["value"])
+        ]
+        st.markdown("  \n".join(lines))
+
+    nearby = data.nearby(key, point)
+    if nearby:
+        positivity = data.positivity(key, date, window)
+        st.markdown(f"**Within {MAP_DEPARTMENTS[key]['spread_radius']:g} px**")
+        st.markdown("  \n".join(
+            f"Point {other} ({distance:.0f} px): "
+            + (f"{positivity[other] * 100:.1f}%" if pd.notna(positivity.get(other, np.nan)) else "N/A")
+            for other, distance in nearby
+        ))
+
+
+def _clicked_point(selection):
+    # Point code of a clicked marker; box selections zoom instead
+    if not selection or selection.get("box"):
+        return None
+    points = selection.get("points") or []
+    if not points or not points[-1].get("customdata"):
+        return None
+    return str(points[-1]["customdata"][0])
+
+
+def render_map(collection, key):
+    # Draws the map page of the MAP_DEPARTMENTS entry key
+    entry = MAP_DEPARTMENTS[key]
+    image_path = entry["floor_plan"]
+
+    # Load image for background
+    plan = floor_plan(image_path)
+    if plan is None:
+        st.error(f"Image not found at {image_path}")
+        width, height = 0, 0
+    else:
+        width, height = plan[1]
+
+    data = load_map_data(collection)
+    all_data = data.frames[key]
+    if all_data.empty:
+        st.warning("No data found with X and Y coordinates in MongoDB.")
+        return
+
+    if st.toggle("Playback", key=f"{key}_map_playback", help="Animate the floor plan over a range of dates"):
+        dates = data.dates[key]
+        start, end = st.select_slider(
+            "Date range", options=dates,
+            value=(dates[max(len(dates) - PLAYBACK_DEFAULT_DATES, 0)], dates[-1]),
+        )
+        window_days = _window_picker()
+        chosen = [date for date in dates if start <= date <= end]
+        fig = playback_figure(data, key, chosen, window_days, (width, height))
+        # No on_select: playing and scrubbing stay in the browser
+        st.plotly_chart(fig, use_container_width=True, key=f"{key}_map_playback_chart")
+        return
+
+    selected_date = st.selectbox("Select Date", sorted(data.dates[key], reverse=True))
+    window_days = _window_picker()
+    colour_column, heatmap_column = st.columns([3, 1])
+    colour_by = colour_column.radio(
+        "Colour by", ["Positivity", "Spread"], horizontal=True,
+        help=f"Spread blends each point's positivity with the points within {entry['spread_radius']:g} px, nearer ones weighing more",
+    )
+    show_heatmap = HEATMAP_AVAILABLE and heatmap_column.toggle(
+        "Heatmap", key=f"{key}_map_heatmap", help="Positivity density over the floor plan"
+    )
+    show_zones = bool(data.zones[key]) and heatmap_column.toggle(
+        "Zones", key=f"{key}_map_zones", help="Zones filled by their pooled positivity"
+    )
+    if not selected_date:
+        return
+
+    filtered = all_data[all_data['sample_date'].dt.normalize() == pd.Timestamp(selected_date)].copy()
+    if filtered.empty:
+        st.warning("No data found for the selected date.")
+        return
+    filtered['points'] = filtered['points'].astype(str)
+
+    positivity_ratio = data.positivity(key, selected_date, window_days)
+    colors = pd.Series(positivity_colors(positivity_ratio, entry["thresholds"]), index=positivity_ratio.index)
+    percents = (positivity_ratio * 100).round(1).astype(str) + '%'
+    filtered["dot_color"] = filtered["points"].map(colors).fillna(NO_DATA_COLOR)
+    filtered["positivity"] = filtered["points"].map(percents).fillna("N/A")
+
+    if colour_by == "Spread":
+        spread = data.spread(key, selected_date, window_days)
+        spread_colors = pd.Series(
+            np.where(spread.notna(), positivity_colors(spread, entry["thresholds"]), NO_DATA_COLOR),
+            index=spread.index,
+        )
+        filtered["dot_color"] = filtered["points"].map(spread_colors).fillna(NO_DATA_COLOR)
+        filtered["spread"] = filtered["points"].map(
+            ((spread * 100).round(1).astype(str) + '%').where(spread.notna())
+        ).fillna("N/A")
+
+    # Box-select on the chart zooms in; the floor plan then loads only the
+    # tiles in view, at the resolution the view needs. The view is kept
+    # while points are clicked.
+    zoom_key = f"{key}_map_zoom"
+    view_key = f"{key}_map_view"
+    chart_key = f"{key}_map_chart_{st.session_state.get(zoom_key, 0)}"
+    chart_state = st.session_state.get(chart_key)
+    selection = chart_state["selection"] if chart_state else None
+    box_view = view_from_selection(selection, (width, height))
+    if box_view is not None:
+        st.session_state[view_key] = box_view
+    view = st.session_state.get(view_key)
+
+    chart_column, panel_column = st.columns([3, 1])
+    with panel_column:
+        _history_panel(collection, data, key, _clicked_point(selection), filtered, selected_date, window_days)
+    if view is not None and chart_column.button("Reset view"):
+        st.session_state.pop(view_key, None)
+        st.session_state[zoom_key] = st.session_state.get(zoom_key, 0) + 1
+        st.rerun()
+
+    fig = map_figure(
+        filtered, (width, height), view, window_days,
+        title=f"{entry['title']} Detections on {selected_date}",
+        images=layout_images(image_path, view) + (
+            [heatmap_layer(load_heatmap(collection, data, key, selected_date, window_days, (width, height)), (width, height))]
+            if show_heatmap and width else []
+        ),
+    )
+
+    if show_zones:
+        totals = data.zone_totals(key, selected_date, window_days)
+        tested = totals["positivity"].dropna()
+        zone_colors = dict(zip(tested.index, positivity_colors(tested, entry["thresholds"])))
+        shapes, labels = zone_shapes(data.zones[key], totals, zone_colors, height)
+        fig.update_layout(shapes=shapes, annotations=labels)
+
+    chart_column.plotly_chart(
+        fig, use_container_width=True, key=chart_key, on_select="rerun", selection_mode=("points", "box")
+    )
+
+
+if __name__ == "__main__":
+    # Figure build and serialization benchmark, SVG vs WebGL:
+    #   python -m utils.map_engine [markers ...]
+    import sys
+    import time
+
+    rng = np.random.default_rng(0)
+    palette = np.array([SEVERE_COLOR, HIGH_COLOR, LOW_COLOR, CLEAR_COLOR, NO_DATA_COLOR])
+    width, height = 1600, 1400
+
+    for count in [int(n) for n in sys.argv[1:]] or [100, 1_000, 10_000]:
+        markers = pd.DataFrame({
+            "x": rng.uniform(0, width, count).astype(np.float32),
+            "y": rng.uniform(0, height, count).astype(np.float32),
+            "dot_color": palette[rng.integers(0, len(palette), count)],
+            "location_code": pd.Categorical([f"L{i % 500:03d}" for i in range(count)]),
+            "points": [str(i) for i in range(count)],
+            "positivity": [f"{p:.1f}%" for p in rng.uniform(0, 100, count)],
+        })
+        for label, webgl in [("svg", False), ("webgl", True)]:
+            started = time.perf_counter()
+            fig = map_figure(markers, (width, height), None, DEFAULT_WINDOW, "benchmark", webgl=webgl)
+            built = time.perf_counter() - started
+            started = time.perf_counter()
+            spec = fig.to_json()
+            serialized = time.perf_counter() - started
+            print(f"{count:>7,} markers  {label:<6} {len(fig.data):>2} traces  build {built * 1000:7.1f} ms  "
+                  f"to_json {serialized * 1000:7.1f} ms  {len(spec) / 1024:8.1f} KiB")
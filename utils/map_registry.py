@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+# Floor-plan maps, one entry per area: the page key -> floor plan image, the
+# sample filter (equality on listeria fields), the chart title and the
+# positivity thresholds of the dot colours, the neighbourhood radius of the
+# spread score and the kernel bandwidth of the heatmap (floor-plan pixels). Every area is cut from the same
+# load (map_query) and the same rolling counts, so adding an area is an entry
+# here plus a page calling utils.map_engine.render_map with its key.
+
+# Dot colours: ratio >= severe, > high, > low, else clear
+DEFAULT_THRESHOLDS = {"severe": 0.5, "high": 0.2, "low": 0.0}
+DEFAULT_SPREAD_RADIUS = 150
+DEFAULT_HEATMAP_BANDWIDTH = 80
+
+MAP_DEPARTMENTS = {
+    "fresh": {
+        "title": "Fresh Department",
+        "floor_plan": "koral6_3.png",
+        "filter": {"fresh_smoked": "Fresh"},
+        "thresholds": DEFAULT_THRESHOLDS,
+        "spread_radius": DEFAULT_SPREAD_RADIUS,
+        "heatmap_bandwidth": DEFAULT_HEATMAP_BANDWIDTH,
+    },
+    "smoked": {
+        "title": "Smoked Department",
+        "floor_plan": "smoked_3.png",
+        "filter": {"fresh_smoked": "Smoking + Packing"},
+        "thresholds": DEFAULT_THRESHOLDS,
+        "spread_radius": DEFAULT_SPREAD_RADIUS,
+        "heatmap_bandwidth": DEFAULT_HEATMAP_BANDWIDTH,
+    },
+}
+
+
+def map_query():
+    # The one find behind every map: samples of any registered area. Their
+    # positions come from the location registry (utils/locations.py), or
+    # from x/y on older samples; samples with neither are left off the maps.
+    filters = [entry["filter"] for entry in MAP_DEPARTMENTS.values()]
+    if len(filters) == 1:
+        return dict(filters[0])
+    return {"$or": filters}
+
+
+def area_for(fields):
+    # Key of the first area whose filter matches fields (a sample or
+    # location document), or None
+    for key, entry in MAP_DEPARTMENTS.items():
+        if all(fields.get(field) == value for field, value in entry["filter"].items()):
+            return key
+    return None
+
+
+def _stored_codes(codes):
+    # Codes are text in the frames but may be stored as numbers
+    stored = list(codes)
+    stored.extend(int(code) for code in codes if code.lstrip("-").isdigit())
+    return stored
+
+
+def point_history_query(key, point, location_codes, date, window):
+    # Samples in the window (date - window, date] that may belong to one point:
+    # stored under it (points, or the legacy point), or at one of its
+    # location_codes (points filled from the location registry). Each branch
+    # is served by its own index; rows of a location_code that name another
+    # point are dropped after loading.
+    end = datetime(date.year, date.month, date.day) + timedelta(days=1)
+    points = _stored_codes([point])
+    branches = [{"points": {"$in": points}}, {"point": {"$in": points}}]
+    if location_codes:
+        branches.append({"location_code": {"$in": _stored_codes(location_codes)}})
+    return {
+        **MAP_DEPARTMENTS[key]["filter"],
+        "$or": branches,
+        "sample_date": {"$gte": end - timedelta(days=window), "$lt": end},
+    }
+
+
+def filter_fields():
+    # Fields the area filters read, loaded alongside MAP_FIELDS
+    return sorted({field for entry in MAP_DEPARTMENTS.values() for field in entry["filter"]})
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+# Rolling-window detection counts for the map pages. The samples are laid out
+# once as a (point, day) grid of cumulative counts, so the counts of any
+# window ending on any date are one subtraction per point:
+#     counts(date, window) = cum[:, day + 1] - cum[:, day + 1 - window]
+# Switching the date (or the window) never rescans the frame.
+
+# Window lengths offered on the map pages (days); any other length works too
+WINDOW_OPTIONS = [7, 14, 28, 56, 90]
+DEFAULT_WINDOW = 28
+
+
+class RollingCounts:
+    def __init__(self, frame, keys=("points",)):
+        # frame: MAP_FIELDS columns (categorical points, sample_date, Int8 value).
+        # keys: the columns identifying a point; with more than one (e.g.
+        # department and point) results are indexed by a MultiIndex.
+        keys = list(keys)
+        frame = frame.dropna(subset=keys + ["sample_date"])
+        labels = frame[keys].astype(object).astype(str)
+        if len(keys) == 1:
+            labels = pd.Index(labels[keys[0]])
+        else:
+            labels = pd.MultiIndex.from_frame(labels)
+        codes, points = labels.factorize(sort=True)
+        self.points = points.set_names(keys)
+
+        days = frame["sample_date"].to_numpy().astype("datetime64[D]")
+        self.first_day = days.min() if len(days) else np.datetime64("1970-01-01")
+        day_index = (days - self.first_day).astype(np.int64)
+        self.days = int(day_index.max()) + 1 if len(days) else 0
+
+        value = frame["value"]
+        tested = value.notna().to_numpy()
+        score = value.fillna(0).to_numpy(dtype=np.int64)
+
+        # cum[p, d] = count over days [0, d); column 0 is the empty prefix
+        cell = codes * self.days + day_index
+        shape = (len(self.points), self.days)
+        self.cum_samples = _cumulative(cell, np.ones(len(cell), dtype=np.int64), shape)
+        self.cum_tested = _cumulative(cell, tested.astype(np.int64), shape)
+        self.cum_score = _cumulative(cell, score, shape)
+
+    def _bounds(self, date, window):
+        # Prefix columns [lo, hi) covering the window days (date - window, date]
+        day = int((np.datetime64(pd.Timestamp(date), "D") - self.first_day).astype(np.int64))
+        hi = min(max(day + 1, 0), self.days)
+        lo = min(max(day + 1 - window, 0), self.days)
+        return lo, hi
+
+    def counts(self, date, window):
+        # Per-point samples / tested / detected-score in the window ending on date
+        lo, hi = self._bounds(date, window)
+        return pd.DataFrame({
+            "samples": self.cum_samples[:, hi] - self.cum_samples[:, lo],
+            "tested": self.cum_tested[:, hi] - self.cum_tested[:, lo],
+            "detected": self.cum_score[:, hi] - self.cum_score[:, lo],
+        }, index=self.points)
+
+    def window_counts(self, window):
+        # (points x days) samples, tested and detected counts for every window
+        # end at once
+        lo = np.clip(np.arange(1, self.days + 1) - window, 0, None)
+        hi = np.arange(1, self.days + 1)
+        return (self.cum_samples[:, hi] - self.cum_samples[:, lo],
+                self.cum_tested[:, hi] - self.cum_tested[:, lo],
+                self.cum_score[:, hi] - self.cum_score[:, lo])
+
+    def day_index(self, dates):
+        # Grid columns of dates (clipped to the sampled range)
+        days = np.array([np.datetime64(pd.Timestamp(date), "D") for date in dates], dtype="datetime64[D]")
+        return np.clip((days - self.first_day).astype(np.int64), 0, max(self.days - 1, 0))
+
+    def positivity(self, date, window):
+        # Mean value of the tested samples per point; points with no sample in
+        # the window are left out, points with only untested samples are NaN
+        counts = self.counts(date, window)
+        counts = counts[counts["samples"] > 0]
+        return (counts["detected"] / counts["tested"].where(counts["tested"] > 0)).astype(float)
+
+
+def _cumulative(cell, weights, shape):
+    grid = np.bincount(cell, weights=weights, minlength=shape[0] * shape[1]).astype(np.int64).reshape(shape)
+    cum = np.zeros((shape[0], shape[1] + 1), dtype=np.int64)
+    np.cumsum(grid, axis=1, out=cum[:, 1:])
+    return cum
+
@@ -0,0 +1,165 @@
+import numpy as np
+import plotly.graph_objects as go
+from pymongo import UpdateOne
+
+try:
+    import cv2
+except ImportError:  # registration needs OpenCV; the Admin tool is hidden without it
+    cv2 = None
+
+from utils.floorplan import layout_images
+from utils.map_registry import MAP_DEPARTMENTS
+
+# Floor-plan registration: when a floor plan is redrawn, the homography from
+# the old image to the new one is estimated from matched ORB features
+# (RANSAC), previewed on the stored positions, then applied to every stored
+# x/y of the area as one server-side update per collection (an update
+# pipeline evaluating the projective transform), so no document is read.
+# Zone polygons (utils.zones) are in the same floor-plan pixels and are
+# moved with them, in one bulk write.
+REGISTRATION_AVAILABLE = cv2 is not None
+ORB_FEATURES = 5000
+RATIO_TEST = 0.75
+MIN_INLIERS = 12
+# RANSAC reprojection threshold, in new-image pixels
+RANSAC_THRESHOLD = 4.0
+
+
+def _gray(image):
+    if image.ndim == 3:
+        code = cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        return cv2.cvtColor(image, code)
+    return image
+
+
+def decode_image(data):
+    # Uploaded image bytes -> grayscale array; raises ValueError
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError("Cannot read the uploaded image")
+    return _gray(image)
+
+
+def read_image(path):
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"Cannot read floor plan {path}")
+    return _gray(image)
+
+
+def estimate_homography(old, new):
+    # (3 x 3 homography mapping old-image pixels to new-image pixels,
+    # inlier count, match count); raises ValueError when the images do not
+    # match well enough
+    orb = cv2.ORB_create(nfeatures=ORB_FEATURES)
+    old_points, old_descriptors = orb.detectAndCompute(old, None)
+    new_points, new_descriptors = orb.detectAndCompute(new, None)
+    if old_descriptors is None or new_descriptors is None:
+        raise ValueError("No features found in one of the images")
+
+    # Lowe's ratio test keeps matches clearly better than the runner-up
+    matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+    matches = [
+        pair[0] for pair in matcher.knnMatch(old_descriptors, new_descriptors, k=2)
+        if len(pair) == 2 and pair[0].distance < RATIO_TEST * pair[1].distance
+    ]
+    if len(matches) < MIN_INLIERS:
+        raise ValueError(f"Only {len(matches)} matching features; the images may not show the same plan")
+
+    source = np.float32([old_points[m.queryIdx].pt for m in matches]).reshape(-1, 1, 2)
+    target = np.float32([new_points[m.trainIdx].pt for m in matches]).reshape(-1, 1, 2)
+    homography, mask = cv2.findHomography(source, target, cv2.RANSAC, RANSAC_THRESHOLD)
+    inliers = int(mask.sum()) if mask is not None else 0
+    if homography is None or inliers < MIN_INLIERS:
+        raise ValueError(f"Only {inliers} consistent matches; the images may not show the same plan")
+    return homography, inliers, len(matches)
+
+
+def transform_points(homography, x, y):
+    points = np.column_stack([np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)])
+    if not len(points):
+        return points[:, 0], points[:, 1]
+    moved = cv2.perspectiveTransform(points.reshape(-1, 1, 2), np.asarray(homography, dtype=np.float64))
+    return moved[:, 0, 0], moved[:, 0, 1]
+
+
+def _projected(homography, row):
+    # (h[row] . (x, y, 1)) / (h[2] . (x, y, 1)) as an aggregation expression
+    def dot(coefficients):
+        a, b, c = (float(value) for value in coefficients)
+        return {"$add": [{"$multiply": [a, "$x"]}, {"$multiply": [b, "$y"]}, c]}
+
+    return {"$divide": [dot(homography[row]), dot(homography[2])]}
+
+
+def remap_filter(key):
+    # Documents of area key with numeric coordinates
+    return {**MAP_DEPARTMENTS[key]["filter"], "x": {"$type": "number"}, "y": {"$type": "number"}}
+
+
+def apply_homography(collection, key, homography):
+    # Rewrites x/y of every positioned document of area key in one update;
+    # both coordinates are computed from the old values. Returns the count.
+    homography = np.asarray(homography, dtype=np.float64)
+    update = [{"$set": {"x": _projected(homography, 0), "y": _projected(homography, 1)}}]
+    return collection.update_many(remap_filter(key), update).modified_count
+
+
+def remap_zones(zones_collection, key, homography):
+    # Moves every zone polygon of area key vertex by vertex; returns the count
+    operations = []
+    for doc in zones_collection.find({"area": key}, {"polygon": 1}):
+        polygon = np.asarray(doc.get("polygon") or [], dtype=float)
+        if polygon.ndim != 2 or polygon.shape[1] != 2 or not len(polygon):
+            continue
+        x, y = transform_points(homography, polygon[:, 0], polygon[:, 1])
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"polygon": np.column_stack([x, y]).tolist()}}))
+    if not operations:
+        return 0
+    return zones_collection.bulk_write(operations, ordered=False).modified_count
+
+
+def _outlines(polygons, height):
+    # Closed outlines of polygons as one line trace, y-up like the maps
+    xs, ys = [], []
+    for x, y in polygons:
+        xs.extend(list(x) + [x[0], None])
+        ys.extend([height - value for value in y] + [height - y[0], None])
+    return xs, ys
+
+
+def preview_figure(key, positions, homography, size, zones=()):
+    # Stored positions and zone outlines (grey) and where the transform moves
+    # them (red) on the current floor plan of area key; zones: (name, vertex
+    # array) pairs as from utils.zones.load_zones
+    width, height = size
+    x, y = transform_points(homography, positions["x"], positions["y"])
+    fig = go.Figure()
+    for image in layout_images(MAP_DEPARTMENTS[key]["floor_plan"]):
+        fig.add_layout_image(image)
+    if zones:
+        stored = [(polygon[:, 0], polygon[:, 1]) for _, polygon in zones]
+        for name, color, polygons in (
+            ("Stored zones", "#A9A9A9", stored),
+            ("Remapped zones", "#FF0000", [transform_points(homography, px, py) for px, py in stored]),
+        ):
+            xs, ys = _outlines(polygons, height)
+            fig.add_trace(go.Scatter(x=xs, y=ys, mode="lines", name=name, line=dict(width=2, color=color), hoverinfo="skip"))
+    labels = positions.index.astype(str)
+    fig.add_trace(go.Scatter(
+        x=positions["x"], y=height - positions["y"], mode="markers", name="Stored",
+        marker=dict(size=9, color="#A9A9A9", line=dict(width=1, color="DarkSlateGrey")),
+        text=labels, hovertemplate="Point %{text} (stored)<extra></extra>",
+    ))
+    fig.add_trace(go.Scatter(
+        x=x, y=height - y, mode="markers", name="Remapped",
+        marker=dict(size=9, color="#FF0000", line=dict(width=1, color="DarkSlateGrey")),
+        text=labels, hovertemplate="Point %{text} (remapped)<extra></extra>",
+    ))
+    fig.update_layout(
+        xaxis=dict(visible=False, range=[0, width]),
+        yaxis=dict(visible=False, range=[0, height]),
+        margin=dict(l=0, r=0, t=30, b=0),
+        legend=dict(orientation="h"),
+    )
+    return fig
@@ -0,0 +1,144 @@
+from datetime import datetime, timezone
+
+import pandas as pd
+from pymongo import UpdateOne
+
+from utils.constants import ROLLUP_COLLECTION, ROLLUP_KEYS
+
+# Materialized daily rollup of the raw listeria samples. One row per
+# (date, department, phase, sub_area, location_code) holding the counts every
+# Trend chart and KPI needs, so reads scale with days x locations rather than
+# with the number of samples ever uploaded. "week" rides along with the date
+# because the weekly chart groups on the uploaded week label. The collection
+# and its key (ROLLUP_COLLECTION, ROLLUP_KEYS) live in utils.constants.
+#
+# Only a full rebuild makes the rollup complete, so rebuild_rollup records a
+# "built" marker and nothing else does. Until it exists readers group the raw
+# samples and uploads leave the rollup alone, instead of filling it with just
+# the uploads since.
+ROLLUP_STATE_COLLECTION = "listeria_rollup_state"
+ROLLUP_BUILT = {"_id": "rollup_built"}
+
+# samples:      every sample document (the "Total Samples" KPI)
+# total:        samples that have a test_result (what the charts count)
+# detected:     test_result == "Detected"
+# not_detected: test_result == "Not Detected" (the KPI counts everything else as detected)
+ROLLUP_COUNTS = ["samples", "total", "detected", "not_detected"]
+
+# test_result is present and not missing, i.e. what pandas' "count" counts.
+# Mongo compares NaN equal to NaN, so null/absent values are folded into NaN.
+HAS_RESULT = {"$ne": [{"$ifNull": ["$test_result", float("nan")]}, float("nan")]}
+
+
+# $group accumulators producing ROLLUP_COUNTS from raw sample documents
+RAW_COUNTS = {
+    "samples": {"$sum": 1},
+    "total": {"$sum": {"$cond": [HAS_RESULT, 1, 0]}},
+    "detected": {"$sum": {"$cond": [{"$eq": ["$test_result", "Detected"]}, 1, 0]}},
+    "not_detected": {"$sum": {"$cond": [{"$eq": ["$test_result", "Not Detected"]}, 1, 0]}},
+}
+
+
+def rollup_collection_for(collection):
+    return collection.database[ROLLUP_COLLECTION]
+
+
+def rollup_state_for(collection):
+    return collection.database[ROLLUP_STATE_COLLECTION]
+
+
+def rollup_built(collection):
+    return rollup_state_for(collection).find_one(ROLLUP_BUILT, {"_id": 1}) is not None
+
+
+def rollup_pipeline():
+    return [
+        {"$group": {
+            "_id": {key: {"$ifNull": [f"${key}", None]} for key in ROLLUP_KEYS},
+            **RAW_COUNTS,
+        }},
+        {"$project": {
+            "_id": 0,
+            **{key: f"$_id.{key}" for key in ROLLUP_KEYS},
+            **{count: 1 for count in ROLLUP_COUNTS},
+        }},
+        {"$out": ROLLUP_COLLECTION},
+    ]
+
+
+def rebuild_rollup(collection):
+    # Full recompute from the raw samples; used for the initial backfill and
+    # whenever the rollup may have drifted (e.g. a partially failed upload).
+    list(collection.aggregate(rollup_pipeline()))
+    rows = rollup_collection_for(collection).count_documents({})
+    rollup_state_for(collection).update_one(
+        ROLLUP_BUILT, {"$set": {"built_at": datetime.now(timezone.utc), "rows": rows}}, upsert=True
+    )
+    return rows
+
+
+def count_rows(frame, keys):
+    # In-memory equivalent of a RAW_COUNTS $group: one row per distinct key,
+    # missing keys kept as their own group
+    keys = list(keys)
+    frame = frame.reindex(columns=keys + ["test_result"])
+    result = frame["test_result"]
+    return (
+        frame[keys]
+        .assign(
+            samples=1,
+            total=result.notna().astype(int),
+            detected=(result == "Detected").astype(int),
+            not_detected=(result == "Not Detected").astype(int),
+        )
+        .groupby(keys, dropna=False, observed=True)[ROLLUP_COUNTS]
+        .sum()
+        .reset_index()
+    )
+
+
+def rollup_increments(frame, removed=None):
+    # Counts contributed by a batch of new sample rows, one row per rollup key.
+    # removed: stored rows the batch replaced, whose counts are taken back out
+    counts = count_rows(frame, ROLLUP_KEYS)
+    if removed is not None and len(removed):
+        taken = count_rows(removed, ROLLUP_KEYS)
+        taken[ROLLUP_COUNTS] = -taken[ROLLUP_COUNTS]
+        counts = (
+            pd.concat([counts, taken], ignore_index=True)
+            .groupby(ROLLUP_KEYS, dropna=False, sort=False)[ROLLUP_COUNTS]
+            .sum()
+            .reset_index()
+        )
+        counts = counts[counts[ROLLUP_COUNTS].ne(0).any(axis=1)]
+    counts["sample_date"] = pd.to_datetime(counts["sample_date"], errors="coerce")
+    counts = counts.astype(object).where(counts.notna(), None)
+    return counts.to_dict(orient="records")
+
+
+def apply_to_rollup(collection, frame, removed=None):
+    # Folds a freshly written batch into the rollup with one $inc upsert per
+    # key; removed: the previous versions of rows the batch updated. Skipped
+    # until the rollup has been built (the rebuild will count the batch).
+    if not rollup_built(collection):
+        return 0
+    operations = []
+    for row in rollup_increments(frame, removed):
+        key = {name: _bson_value(row[name]) for name in ROLLUP_KEYS}
+        operations.append(UpdateOne(
+            key,
+            {"$inc": {count: int(row[count]) for count in ROLLUP_COUNTS}},
+            upsert=True,
+        ))
+    if not operations:
+        return 0
+    result = rollup_collection_for(collection).bulk_write(operations, ordered=False)
+    return result.upserted_count + result.modified_count
+
+
+def _bson_value(value):
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if hasattr(value, "item"):
+        return value.item()
+    return value
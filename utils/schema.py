@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+
+# Canonical vocabularies of the listeria columns
+DEPARTMENT_AREAS = {
+    "Fresh": ["PRODUCTION", "DEBONING", "DESKINNING", "INJECTOR", "WASHER"],
+    "Smoking + Packing": ["ENTRANCE", "LKPW1", "LKPW2", "CFS", "OTHER"],
+}
+DEPARTMENTS = list(DEPARTMENT_AREAS)
+# Sub areas in process-flow order (the Trend Analysis x axis)
+SUB_AREAS = [area for areas in DEPARTMENT_AREAS.values() for area in areas]
+PHASES = ["BP", "DP"]
+TEST_RESULTS = ["Detected", "Not Detected"]
+
+# Fixed leading categories per categorical column. Values outside the list
+# are kept and sorted after it, so nothing is lost to NaN.
+CATEGORIES = {
+    "test_result": TEST_RESULTS,
+    "sub_area": SUB_AREAS,
+    "fresh_smoked": DEPARTMENTS,
+    "before_during": PHASES,
+}
+
+# Per-page field schemas: field name -> column type.
+# Each schema is turned into a Mongo projection (so only these fields cross the
+# wire) and into typed column decoding once per load. Column types:
+#   category - low-cardinality text as a pandas Categorical (see CATEGORIES)
+#   int8     - 0/1 flags, nullable (Int8) so missing results stay missing
+#   float32, datetime (datetime64[us]), str
+TREND_FIELDS = {
+    "sample_date": "datetime",
+    "test_result": "category",
+    "week": "category",
+    "sub_area": "category",
+    "before_during": "category",
+    "fresh_smoked": "category",
+}
+
+MAP_FIELDS = {
+    "points": "category",
+    "x": "float32",
+    "y": "float32",
+    "value": "int8",
+    "sample_date": "datetime",
+    "location_code": "category",
+    "before_during": "category",
+}
+
+# One map point's history, fetched when the point is clicked. points and
+# location_code resolve each row's point the way the map does (legacy alias,
+# then the location registry).
+POINT_HISTORY_FIELDS = {
+    "sample_date": "datetime",
+    "value": "int8",
+    "points": "str",
+    "location_code": "str",
+}
+
+# Older uploads stored the sampling point under "point" instead of "points"
+FIELD_ALIASES = {
+    "points": ["point"],
+}
+
+
+def projection_for(schema):
+    projection = {"_id": 0}
+    for field in schema:
+        projection[field] = 1
+        for alias in FIELD_ALIASES.get(field, []):
+            projection[alias] = 1
+    return projection
+
+
+def category_dtype(field, values):
+    # values: the distinct non-missing strings seen for the field
+    known = CATEGORIES.get(field, [])
+    extra = sorted(set(values).difference(known))
+    return pd.CategoricalDtype(known + extra)
+
+
+def to_int8(values):
+    numbers = pd.to_numeric(values, errors="coerce")
+    # Anything that is not a whole number in int8 range is treated as missing
+    valid = numbers.notna() & (numbers == numbers.round()) & numbers.between(-128, 127)
+    return numbers.where(valid).astype("Int8")
+
+
+def as_text(value):
+    # Canonical text of a code: codes arrive as text, int or float depending
+    # on the upload, so 12, 12.0 and "12" all read as "12"; missing is None
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, float):
+        if value != value:
+            return None
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
+
+
+def _decode_column(values, kind, field=None):
+    if kind == "datetime":
+        return pd.to_datetime(values, errors="coerce")
+    if kind == "float32":
+        return pd.to_numeric(values, errors="coerce").astype(np.float32)
+    if kind == "int8":
+        return to_int8(values)
+    if kind in ("str", "category"):
+        values = values.where(values.isna(), values.astype(str))
+        if kind == "category":
+            return values.astype(category_dtype(field, values.dropna().unique()))
+        return values
+    raise ValueError(f"Unknown column type '{kind}'")
+
+
+def _source_column(raw, name, kind):
+    values = raw[name]
+    if kind in ("str", "category"):
+        # Same text as the BSON loader: 12 and 12.0 both read as "12"
+        values = values.astype(object).map(as_text, na_action="ignore")
+    return values
+
+
+def decode_frame(raw, schema):
+    frame = pd.DataFrame(index=raw.index)
+    for field, kind in schema.items():
+        if field in raw.columns:
+            values = _source_column(raw, field, kind)
+        else:
+            values = pd.Series(None, index=raw.index, dtype=object)
+        for alias in FIELD_ALIASES.get(field, []):
+            if alias in raw.columns:
+                values = values.where(values.notna(), _source_column(raw, alias, kind))
+        frame[field] = _decode_column(values, kind, field)
+    return frame
+
+
+def conform_frame(frame, schema):
+    # Re-applies the canonical categories, e.g. after concatenating frames
+    # whose categoricals were built from different batches
+    for field, kind in schema.items():
+        if kind == "category":
+            values = frame[field].astype(object)
+            frame[field] = values.astype(category_dtype(field, values.dropna().unique()))
+    return frame
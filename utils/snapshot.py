@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import time
+from datetime import timedelta
+
+import pandas as pd
+from bson import ObjectId
+
+from utils.bson_loader import load_columns
+from utils.schema import conform_frame
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # snapshots are an optimisation; without pyarrow we read Mongo directly
+    feather = None
+
+# On-disk columnar snapshots of decoded listeria frames (Arrow IPC / Feather,
+# uncompressed so they can be memory-mapped). A cold start reads the snapshot
+# and only asks Mongo for documents newer than its high-water mark, the
+# largest ObjectId it holds. ObjectIds from different clients are only ordered
+# to the second, so every refresh re-reads a short overlap window and drops
+# ids the snapshot already has.
+#
+# In-place edits (the Admin X/Y update) are invisible to the high-water mark,
+# so writers call drop_snapshots(); deletions are picked up by the periodic
+# full rebuild after SNAPSHOT_MAX_AGE_HOURS.
+SNAPSHOT_DIR = os.getenv("LISTERIA_SNAPSHOT_DIR", os.path.join(".cache", "snapshots"))
+SNAPSHOT_MAX_AGE_HOURS = float(os.getenv("LISTERIA_SNAPSHOT_MAX_AGE_HOURS", "24"))
+SNAPSHOTS_ENABLED = feather is not None and os.getenv("LISTERIA_SNAPSHOTS", "1") != "0"
+
+HWM_OVERLAP = timedelta(seconds=5)
+ID_COLUMN = "_id"
+
+
+def _snapshot_paths(collection, query, schema):
+    key = json.dumps([collection.full_name, query or {}, schema], sort_keys=True, default=str)
+    name = f"{collection.name}-{hashlib.sha1(key.encode()).hexdigest()[:16]}"
+    base = os.path.join(SNAPSHOT_DIR, name)
+    return base + ".feather", base + ".json"
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(frame, meta, data_path, meta_path):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    feather.write_feather(frame, data_path + ".tmp", compression="uncompressed")
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(data_path + ".tmp", data_path)
+    os.replace(meta_path + ".tmp", meta_path)
+
+
+def _fetch(collection, query, schema, since=None):
+    if since is not None:
+        query = {"$and": [query or {}, {ID_COLUMN: {"$gte": since}}]}
+    return load_columns(collection, query, schema, with_ids=True)
+
+
+def _store(frame, data_path, meta_path, built_at):
+    frame = frame.reset_index(drop=True)
+    meta = {
+        "hwm": frame[ID_COLUMN].max() if len(frame) else None,
+        "rows": len(frame),
+        "built_at": built_at,
+        "refreshed_at": time.time(),
+    }
+    _write_atomic(frame, meta, data_path, meta_path)
+    return frame
+
+
+def load_snapshot(collection, query, schema):
+    # Returns the decoded frame for (query, schema), refreshed from Mongo
+    data_path, meta_path = _snapshot_paths(collection, query, schema)
+    meta = _read_meta(meta_path)
+    expired = meta is None or time.time() - meta["built_at"] > SNAPSHOT_MAX_AGE_HOURS * 3600
+
+    if expired or not os.path.exists(data_path):
+        frame = _store(_fetch(collection, query, schema), data_path, meta_path, time.time())
+        return frame.drop(columns=[ID_COLUMN])
+
+    frame = feather.read_feather(data_path, memory_map=True)
+    since = None
+    if meta["hwm"]:
+        since = ObjectId.from_datetime(ObjectId(meta["hwm"]).generation_time - HWM_OVERLAP)
+    delta = _fetch(collection, query, schema, since)
+    if since is not None:
+        delta = delta[~delta[ID_COLUMN].isin(frame.loc[frame[ID_COLUMN] >= str(since), ID_COLUMN])]
+
+    if not delta.empty:
+        frame = pd.concat([frame, delta], ignore_index=True)
+        frame = _store(conform_frame(frame, schema), data_path, meta_path, meta["built_at"])
+    return frame.drop(columns=[ID_COLUMN])
+
+
+def drop_snapshots():
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return 0
+    dropped = 0
+    for name in os.listdir(SNAPSHOT_DIR):
+        if name.endswith((".feather", ".json")):
+            os.remove(os.path.join(SNAPSHOT_DIR, name))
+            dropped += 1
+    return dropped
@@ -0,0 +1,114 @@
+import numpy as np
+
+# Uniform grid over the sampling points of one floor plan. Points are bucketed
+# into square cells and sorted by cell, so the points of any cell are one
+# contiguous slice found by binary search. A radius query only visits the
+# cells the radius can reach; with the cell size equal to the radius that is
+# the 3 x 3 block around the point.
+
+
+class PointGrid:
+    def __init__(self, x, y, cell):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.cell = float(cell)
+        if self.cell <= 0:
+            raise ValueError("Grid cell size must be positive")
+        cx = np.floor(self.x / self.cell).astype(np.int64)
+        cy = np.floor(self.y / self.cell).astype(np.int64)
+        self.origin = (int(cx.min()), int(cy.min())) if len(cx) else (0, 0)
+        self.cx = cx - self.origin[0]
+        self.cy = cy - self.origin[1]
+        self.shape = (int(self.cx.max()) + 1, int(self.cy.max()) + 1) if len(cx) else (0, 0)
+        cells = self.cx * self.shape[1] + self.cy
+        self.order = np.argsort(cells, kind="stable")
+        self.cells = cells[self.order]
+
+    def __len__(self):
+        return len(self.x)
+
+    def _members(self, cx, cy):
+        # Point indices in cells (cx, cy), plus the query each belongs to
+        inside = (cx >= 0) & (cx < self.shape[0]) & (cy >= 0) & (cy < self.shape[1])
+        cells = cx * self.shape[1] + cy
+        starts = np.searchsorted(self.cells, cells, side="left")
+        ends = np.where(inside, np.searchsorted(self.cells, cells, side="right"), starts)
+        counts = ends - starts
+        owners = np.repeat(np.arange(len(cells)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return owners, self.order[np.repeat(starts, counts) + offsets]
+
+    def _candidates(self, cx, cy, radius):
+        reach = int(np.ceil(radius / self.cell))
+        owners, members = [], []
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                owner, member = self._members(cx + dx, cy + dy)
+                owners.append(owner)
+                members.append(member)
+        return np.concatenate(owners), np.concatenate(members)
+
+    def pairs(self, radius):
+        # (i, j, distance) for every ordered pair of distinct points at most
+        # radius apart
+        if not len(self):
+            empty = np.array([], dtype=np.int64)
+            return empty, empty, np.array([], dtype=float)
+        i, j = self._candidates(self.cx, self.cy, radius)
+        distance = np.hypot(self.x[i] - self.x[j], self.y[i] - self.y[j])
+        keep = (i != j) & (distance <= radius)
+        return i[keep], j[keep], distance[keep]
+
+    def within(self, x, y, radius):
+        # (indices, distances) of the points at most radius from (x, y),
+        # nearest first
+        if not len(self):
+            return np.array([], dtype=np.int64), np.array([], dtype=float)
+        cx = np.array([int(np.floor(x / self.cell)) - self.origin[0]])
+        cy = np.array([int(np.floor(y / self.cell)) - self.origin[1]])
+        _, j = self._candidates(cx, cy, radius)
+        distance = np.hypot(self.x[j] - x, self.y[j] - y)
+        keep = distance <= radius
+        j, distance = j[keep], distance[keep]
+        nearest = np.argsort(distance, kind="stable")
+        return j[nearest], distance[nearest]
+
+
+def spread_scores(values, pairs, radius):
+    # Per point, the weighted mean of its own value (weight 1) and its
+    # neighbours' values (weight 1 - distance / radius), so nearby positives
+    # count more than far ones. NaN values are skipped; NaN where a point and
+    # all its neighbours are NaN.
+    values = np.asarray(values, dtype=float)
+    i, j, distance = pairs
+    known = ~np.isnan(values)
+    filled = np.where(known, values, 0.0)
+    weights = np.where(known[j], 1.0 - distance / radius, 0.0)
+    total = filled + np.bincount(i, weights=weights * filled[j], minlength=len(values))
+    weight = known + np.bincount(i, weights=weights, minlength=len(values))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(weight > 0, total / weight, np.nan)
+
+
+if __name__ == "__main__":
+    # Grid build, neighbour pairs and spread score timings:
+    #   python -m utils.spatial [points ...]
+    import sys
+    import time
+
+    rng = np.random.default_rng(0)
+    radius = 150.0
+    for count in [int(n) for n in sys.argv[1:]] or [100, 1_000, 10_000]:
+        x, y = rng.uniform(0, 1600, count), rng.uniform(0, 1400, count)
+        values = np.where(rng.random(count) < 0.2, np.nan, rng.random(count))
+        started = time.perf_counter()
+        grid = PointGrid(x, y, radius)
+        built = time.perf_counter() - started
+        started = time.perf_counter()
+        pairs = grid.pairs(radius)
+        paired = time.perf_counter() - started
+        started = time.perf_counter()
+        spread_scores(values, pairs, radius)
+        scored = time.perf_counter() - started
+        print(f"{count:>7,} points  grid {built * 1000:6.2f} ms  pairs {paired * 1000:7.2f} ms "
+              f"({len(pairs[0]):,})  spread {scored * 1000:6.2f} ms")
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+from utils.constants import ZONES_COLLECTION
+from utils.data import load_derived
+
+# Named zones drawn on the floor plans: one document per (area, name) with a
+# polygon in floor-plan pixels, area being a utils.map_registry key. Points
+# are assigned to zones in bulk when the map data is built, so zone counts
+# are one groupby on every rerun. Saving or deleting a zone invalidates the
+# cached map data like any other write.
+
+
+def zones_collection_for(collection):
+    return collection.database[ZONES_COLLECTION]
+
+
+def load_zones(collection):
+    # {area: [(name, (n, 2) vertex array), ...]} in name order
+    def load():
+        zones = {}
+        for doc in collection.find({}, {"_id": 0, "area": 1, "name": 1, "polygon": 1}).sort([("area", 1), ("name", 1)]):
+            polygon = np.asarray(doc.get("polygon") or [], dtype=float)
+            if polygon.ndim == 2 and polygon.shape[0] >= 3 and polygon.shape[1] == 2:
+                zones.setdefault(doc["area"], []).append((doc["name"], polygon))
+        return zones
+
+    return load_derived("zones", collection, {}, load)
+
+
+def contains(polygon, x, y):
+    # Even-odd ray casting for every point against every edge at once
+    x = np.asarray(x, dtype=float)[:, None]
+    y = np.asarray(y, dtype=float)[:, None]
+    x0, y0 = polygon[:, 0], polygon[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    straddles = (y0 > y) != (y1 > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossing = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    return np.count_nonzero(straddles & (x < crossing), axis=1) % 2 == 1
+
+
+def assign_zones(x, y, zones):
+    # Zone name per point (the first zone containing it), None outside all
+    names = np.full(len(x), None, dtype=object)
+    for name, polygon in reversed(zones):
+        names[contains(polygon, x, y)] = name
+    return names
+
+
+def zone_positivity(counts, point_zones):
+    # Per zone tested/detected totals and positivity. counts: per-point
+    # samples/tested/detected (RollingCounts.counts); point_zones: zone per
+    # point, None outside all zones.
+    joined = counts.join(point_zones.rename("zone"), how="inner").dropna(subset=["zone"])
+    totals = joined.groupby("zone")[["samples", "tested", "detected"]].sum()
+    totals["positivity"] = (totals["detected"] / totals["tested"].where(totals["tested"] > 0)).astype(float)
+    return totals
+
+
+def parse_polygon(text):
+    # "x1,y1; x2,y2; x3,y3 ..." -> [[x, y], ...]; raises ValueError
+    vertices = []
+    for pair in text.replace("\n", ";").split(";"):
+        if not pair.strip():
+            continue
+        parts = pair.split(",")
+        if len(parts) != 2:
+            raise ValueError(f"Expected 'x,y', got '{pair.strip()}'")
+        vertices.append([float(parts[0]), float(parts[1])])
+    if len(vertices) < 3:
+        raise ValueError("A zone needs at least 3 vertices")
+    return vertices
+
+
+def save_zone(collection, area, name, polygon):
+    return collection.update_one(
+        {"area": area, "name": name}, {"$set": {"polygon": polygon}}, upsert=True
+    )
+
+
+def delete_zone(collection, area, name):
+    return collection.delete_one({"area": area, "name": name})
+
+
+def zone_shapes(zones, totals, colors, height):
+    # Plotly layout shapes (filled polygons, y-up like the maps) and centroid
+    # labels for zones; colors: fill colour per zone name
+    shapes, labels = [], []
+    for name, polygon in zones:
+        xs, ys = polygon[:, 0], height - polygon[:, 1]
+        path = "M " + " L ".join(f"{x},{y}" for x, y in zip(xs, ys)) + " Z"
+        shapes.append(dict(
+            type="path", path=path, xref="x", yref="y", layer="below",
+            fillcolor=colors.get(name, "#A9A9A9"), opacity=0.3, line=dict(width=1, color="DarkSlateGrey"),
+        ))
+        ratio = totals["positivity"].get(name, np.nan) if name in totals.index else np.nan
+        text = f"<b>{name}</b><br>" + (f"{ratio * 100:.1f}%" if pd.notna(ratio) else "N/A")
+        labels.append(dict(x=float(xs.mean()), y=float(ys.mean()), xref="x", yref="y", text=text,
+                           showarrow=False, font=dict(size=11), bgcolor="rgba(255,255,255,0.6)"))
+    return shapes, labels